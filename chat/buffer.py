@@ -0,0 +1,84 @@
+"""
+Write-behind buffer for chat messages.
+Consumers add messages to the buffer instead of saving each one, the buffer saves them with a single
+bulk_create() once it holds FLUSH_SIZE messages or FLUSH_DELAY seconds after the first pending message.
+Consumers also flush it when they disconnect, and what's still pending is saved when the process exits.
+A batch that fails to save is put back and retried after FLUSH_DELAY, up to MAX_RETRIES times before
+it's logged and dropped.
+"""
+import asyncio
+import atexit
+import logging
+from channels.db import database_sync_to_async
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SIZE = 100
+FLUSH_DELAY = 1.0  # seconds
+MAX_RETRIES = 3
+
+
+class MessageBuffer:
+    def __init__(self, flush_size=FLUSH_SIZE, flush_delay=FLUSH_DELAY):
+        self.flush_size = flush_size
+        self.flush_delay = flush_delay
+        self.pending = []
+        self.timer = None
+        self.failures = 0  # consecutive failed flushes
+
+    async def add(self, message):
+        self.pending.append(message)
+        if len(self.pending) >= self.flush_size:
+            await self.flush()
+        elif self.timer is None:
+            # first pending message: flush it after a delay, together with the ones that follow
+            self.timer = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # take the pending messages before awaiting, the ones added meanwhile go to the next batch
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await database_sync_to_async(ChatMessage.objects.bulk_create)(batch)
+        except Exception:
+            self.failures += 1
+            if self.failures > MAX_RETRIES:
+                self.failures = 0
+                logger.exception('Dropped %d chat messages that could not be saved: %r', len(batch),
+                                 [(m.course_id, m.user_id, m.sent_on, m.content) for m in batch])
+                return
+            logger.exception('Saving %d chat messages failed, retrying in %ss', len(batch), self.flush_delay)
+            # back in front of the messages added meanwhile
+            self.pending[:0] = batch
+            if self.timer is None:
+                self.timer = asyncio.ensure_future(self.flush_later())
+        else:
+            self.failures = 0
+
+    def flush_now(self):
+        """Saves the pending messages from synchronous code, when the process exits."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            try:
+                ChatMessage.objects.bulk_create(batch)
+            except Exception:
+                logger.exception('Lost %d chat messages on shutdown: %r', len(batch),
+                                 [(m.course_id, m.user_id, m.sent_on, m.content) for m in batch])
+
+
+# shared by every consumer of the process
+message_buffer = MessageBuffer()
+atexit.register(message_buffer.flush_now)
@@ -1,22 +1,50 @@
 import json
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.utils import timezone
+from .buffer import message_buffer
+from .models import ChatMessage
 
 
-# View for consumer to accept websocket connections
-# and echo messages it receives from the websocket back to it.
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
+# Consumer that joins every connection of a course's chat room to the same channel layer group,
+# and broadcasts the messages it receives to every member of the group.
+# It's asynchronous, so connections don't hold a worker thread while they are idle.
+class ChatConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.id = self.scope['url_route']['kwargs']['course_id']
+        self.room_group_name = f'chat_{self.id}'
+        # join room group
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         # accept connection (you reject any connection with self.close())
-        self.accept()
+        await self.accept()
 
-    def disconnect(self, close_code):
-        pass  # No need to implement any action when a client closes a connection
+    async def disconnect(self, close_code):
+        # leave room group
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        # save what this connection sent without waiting for the delay, the process may be stopping
+        await message_buffer.flush()
 
-    def receive(self, text_data=None, bytes_data=None):
+    async def receive(self, text_data=None, bytes_data=None):
         # receive message from WebSocket, you treat the text_data as JSON
         if text_data:
             text_data_json = json.loads(text_data)
             message = text_data_json['message']
+            now = timezone.now()
 
-            # send message to WebSocket
-            self.send(text_data=json.dumps({'message': message}))
+            # send message to room group, every member's chat_message() handler receives it
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_message',
+                'message': message,
+                'user': getattr(self.user, 'username', ''),
+                'datetime': now.isoformat(),
+            })
+            if self.user is not None and self.user.is_authenticated:
+                # persisted in batches by the write-behind buffer, not one INSERT per message
+                await message_buffer.add(ChatMessage(course_id=self.id, user_id=self.user.id,
+                                                     content=message, sent_on=now))
+
+    async def chat_message(self, event):
+        # receive message from room group and send it to WebSocket
+        await self.send(text_data=json.dumps({'message': event['message'],
+                                              'user': event['user'],
+                                              'datetime': event['datetime']}))
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from courses.models import Subject, Course
+from educa.routing import application
+
+
+class Command(BaseCommand):
+    help = 'Measures websocket handshakes per second into a chat room, with a warm and with an empty cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connects', type=int, default=500)
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user('chat-benchmark-user')
+        subject = Subject.objects.create(title='Chat benchmark', slug='chat-benchmark')
+        course = Course.objects.create(owner=user, subject=subject, title='Chat benchmark',
+                                       slug='chat-benchmark', overview='')
+        course.students.add(user)
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        try:
+            for name, clear_cache in (('without cache', True), ('with cache', False)):
+                elapsed = asyncio.run(self.run(course.id, session.session_key, options['connects'], clear_cache))
+                self.stdout.write(f"{name}: {options['connects'] / elapsed:.0f} connects/s "
+                                  f"({elapsed / options['connects'] * 1000:.2f}ms per connect)")
+        finally:
+            session.delete()
+            subject.delete()
+            user.delete()
+
+    async def run(self, course_id, session_key, connects, clear_cache):
+        headers = [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode())]
+        elapsed = 0
+        for _ in range(connects):
+            if clear_cache:
+                cache.clear()  # every handshake loads the session, user and enrollments from the database
+            communicator = WebsocketCommunicator(application, f'/ws/chat/room/{course_id}/', headers=headers)
+            start = time.perf_counter()
+            connected, _ = await communicator.connect()
+            elapsed += time.perf_counter() - start
+            assert connected
+            await communicator.disconnect()
+        return elapsed
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import statistics
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from chat.routing import websocket_urlpatterns
+from courses.models import Subject, Course
+
+
+class Command(BaseCommand):
+    help = 'Measures the delivery latency of chat messages broadcast to every client connected to one room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # the room only accepts students enrolled on its course (see CourseMembershipMiddleware)
+        user = User.objects.create_user('chat-benchmark-user')
+        subject = Subject.objects.create(title='Chat benchmark', slug='chat-benchmark')
+        course = Course.objects.create(owner=user, subject=subject, title='Chat benchmark',
+                                       slug='chat-benchmark', overview='')
+        course.students.add(user)
+        try:
+            latencies, connect_time = asyncio.run(self.run(options['clients'], options['messages'], course.id, user))
+        finally:
+            subject.delete()
+            user.delete()
+        latencies.sort()
+        ms = [latency * 1000 for latency in latencies]
+        self.stdout.write(f"{options['clients']} clients, {options['messages']} messages, "
+                          f"{len(ms)} deliveries, connected in {connect_time:.2f}s")
+        self.stdout.write(f'latency p50={statistics.median(ms):.2f}ms '
+                          f'p99={ms[int(len(ms) * 0.99) - 1]:.2f}ms max={ms[-1]:.2f}ms')
+
+    async def run(self, clients, messages, course_id, user):
+        application = URLRouter(websocket_urlpatterns)
+        path = f'/ws/chat/room/{course_id}/'
+        communicators = [WebsocketCommunicator(application, path) for _ in range(clients)]
+        for communicator in communicators:
+            communicator.scope['user'] = user  # without the session and auth middleware
+        start = time.perf_counter()
+        for communicator in communicators:
+            connected, _ = await communicator.connect()
+            assert connected
+        connect_time = time.perf_counter() - start
+
+        latencies = []
+        sender = communicators[0]
+        for i in range(messages):
+            sent = time.perf_counter()
+            await sender.send_to(text_data=json.dumps({'message': f'message {i}'}))
+
+            async def receive(communicator):
+                await communicator.receive_from(timeout=10)
+                return time.perf_counter() - sent
+
+            latencies += await asyncio.gather(*[receive(communicator) for communicator in communicators])
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return latencies, connect_time
@@ -0,0 +1,73 @@
+"""
+Websocket handshake authentication served from the cache.
+A reconnect storm after a deploy would otherwise cost a session, a user and an enrollment query per socket:
+sessions are read from the cache (SESSION_ENGINE = cached_db), users are cached by id (and removed from the
+cache when they change, see signals.py) and enrollments come from courses.enrollment.
+"""
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from channels.auth import AuthMiddleware, _get_user_session_key
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, load_backend
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from courses.enrollment import is_enrolled
+
+USER_CACHE_TIMEOUT = 60 * 60
+
+
+def user_cache_key(user_id):
+    return f'ws_user:{user_id}'
+
+
+@database_sync_to_async
+def get_cached_user(scope):
+    """Same as channels.auth.get_user(), but the user is loaded from the cache."""
+    session = scope['session']
+    try:
+        user_id = _get_user_session_key(session)
+        backend_path = session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = load_backend(backend_path).get_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        cache.set(key, user, USER_CACHE_TIMEOUT)
+    # Verify the session, it's invalidated when the user changes their password
+    session_hash = session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, user.get_session_auth_hash())):
+        return AnonymousUser()
+    return user
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    """Populates scope['user'] from the session, like AuthMiddleware, using the cached user."""
+
+    async def resolve_scope(self, scope):
+        scope['user']._wrapped = await get_cached_user(scope)
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
+
+
+class CourseMembershipMiddleware(BaseMiddleware):
+    """Rejects the handshake of users who aren't enrolled on the course of the room, before the consumer
+    accepts the connection. It wraps a consumer routed with a 'course_id' URL parameter."""
+
+    async def __call__(self, scope, receive, send):
+        course_id = int(scope['url_route']['kwargs']['course_id'])
+        user = scope.get('user') or AnonymousUser()
+        if not await database_sync_to_async(is_enrolled)(user, course_id):
+            message = await receive()
+            if message['type'] == 'websocket.connect':
+                await send({'type': 'websocket.close', 'code': 4003})
+            return
+        return await super().__call__(scope, receive, send)
@@ -1,3 +1,20 @@
 from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
+from courses.models import Course
 
-# Create your models here.
+
+class ChatMessage(models.Model):
+    """A message sent to the chat room of a course"""
+    course = models.ForeignKey(Course, related_name='chat_messages', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='chat_messages', on_delete=models.CASCADE)
+    content = models.TextField()
+    sent_on = models.DateTimeField(default=timezone.now)  # set by the consumer, messages are saved in batches
+
+    class Meta:
+        ordering = ['-sent_on', '-id']
+        # the history of a room is paginated backwards by (sent_on, id)
+        indexes = [models.Index(fields=['course', '-sent_on', '-id'])]
+
+    def __str__(self):
+        return f'{self.user} on {self.course}: {self.content[:50]}'
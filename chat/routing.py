@@ -1,9 +1,9 @@
-from django.urls import re_path, reverse_lazy
+from django.urls import re_path
 from . import consumers
+from .middleware import CourseMembershipMiddleware
 
 
-# URL to route connections to ChatConsumer consumer
+# URL to route connections to ChatConsumer consumer, only students enrolled on the course can connect
 websocket_urlpatterns = [
-    re_path(r'ws/chat/room/(?P<course_id>\d+)/$', consumers.ChatConsumer),
+    re_path(r'ws/chat/room/(?P<course_id>\d+)/$', CourseMembershipMiddleware(consumers.ChatConsumer.as_asgi())),
 ]
-
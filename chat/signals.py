@@ -0,0 +1,11 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .middleware import user_cache_key
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # a changed password changes the session hash, the websocket handshake must see it
+    cache.delete(user_cache_key(instance.pk))
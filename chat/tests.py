@@ -1,3 +1,179 @@
-from django.test import TestCase
+import asyncio
+import json
+from io import StringIO
+from unittest.mock import patch
+from datetime import timedelta
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User, AnonymousUser
+from django.db import DatabaseError
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from courses.models import Subject, Course
+from educa.routing import application
+from .buffer import MessageBuffer, message_buffer
+from .models import ChatMessage
+from .routing import websocket_urlpatterns
+from .views import HISTORY_SIZE
+from educa.testing import QueryBudgetMixin
 
-# Create your tests here.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class ChatTestMixin(object):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('student', password='secret')
+        subject = Subject.objects.create(title='Programming', slug='programming')
+        self.course = Course.objects.create(owner=self.user, subject=subject,
+                                            title='Django', slug='django', overview='Web')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+# database_sync_to_async closes the connection after each call, which TestCase's transaction doesn't survive
+class ChatConsumerTests(ChatTestMixin, TransactionTestCase):
+    def communicator(self, user, course_id=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f'/ws/chat/room/{course_id or self.course.id}/')
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_messages_are_broadcast_to_the_room(self):
+        students = [await database_sync_to_async(User.objects.create_user)(f'student{i}') for i in range(3)]
+        await database_sync_to_async(self.course.students.add)(*students)
+        room = [self.communicator(student) for student in students]
+        for communicator in room:
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        await room[0].send_to(text_data=json.dumps({'message': 'hello'}))
+        for communicator in room:
+            response = json.loads(await communicator.receive_from())
+            self.assertEqual(response['message'], 'hello')
+            self.assertEqual(response['user'], 'student0')
+
+        for communicator in room:
+            await communicator.disconnect()  # flushes the buffer
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 1)
+
+    async def test_rejects_students_not_enrolled(self):
+        connected, code = await self.communicator(self.user).connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4003)
+        connected, _ = await self.communicator(AnonymousUser()).connect()
+        self.assertFalse(connected)
+
+    async def test_handshake_with_session_cookie(self):
+        await database_sync_to_async(self.course.students.add)(self.user)
+        await database_sync_to_async(self.client.login)(username='student', password='secret')
+        cookie = f"sessionid={self.client.cookies['sessionid'].value}".encode()
+        for _ in range(2):  # the second handshake reads the user from the cache
+            communicator = WebsocketCommunicator(application, f'/ws/chat/room/{self.course.id}/',
+                                                 headers=[(b'cookie', cookie)])
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.disconnect()
+
+
+class MessageBufferTests(ChatTestMixin, TransactionTestCase):
+    def message(self, content):
+        return ChatMessage(course=self.course, user=self.user, content=content)
+
+    async def test_flushes_on_size(self):
+        buffer = MessageBuffer(flush_size=3, flush_delay=60)
+        await buffer.add(self.message('1'))
+        await buffer.add(self.message('2'))
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 0)
+        await buffer.add(self.message('3'))
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 3)
+        self.assertEqual(buffer.pending, [])
+
+    async def test_flushes_after_delay(self):
+        buffer = MessageBuffer(flush_size=100, flush_delay=0.01)
+        await buffer.add(self.message('1'))
+        await asyncio.sleep(0.05)
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 1)
+
+    async def test_failed_batch_is_retried(self):
+        buffer = MessageBuffer(flush_size=2, flush_delay=0.01)
+        bulk_create = ChatMessage.objects.bulk_create
+        failures = [DatabaseError('down')]
+
+        def fail_once(batch):
+            if failures:
+                raise failures.pop()
+            return bulk_create(batch)
+
+        with patch.object(ChatMessage.objects, 'bulk_create', side_effect=fail_once), \
+                self.assertLogs('chat.buffer', 'ERROR'):
+            await buffer.add(self.message('1'))
+            await buffer.add(self.message('2'))
+            self.assertEqual([m.content for m in buffer.pending], ['1', '2'])
+            await asyncio.sleep(0.05)
+        self.assertEqual(await database_sync_to_async(ChatMessage.objects.count)(), 2)
+        self.assertEqual(buffer.pending, [])
+
+    async def test_batch_is_dropped_after_retries(self):
+        buffer = MessageBuffer(flush_size=1, flush_delay=0.01)
+        with patch.object(ChatMessage.objects, 'bulk_create', side_effect=DatabaseError('down')), \
+                self.assertLogs('chat.buffer', 'ERROR') as logs:
+            await buffer.add(self.message('1'))
+            await asyncio.sleep(0.2)
+        self.assertEqual(buffer.pending, [])
+        self.assertIn('Dropped 1 chat messages', logs.output[-1])
+
+    def test_pending_messages_are_saved_on_exit(self):
+        buffer = MessageBuffer(flush_size=100, flush_delay=60)
+        buffer.pending.append(self.message('1'))
+        buffer.flush_now()
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+
+class ChatHistoryTests(ChatTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('chat:course_chat_history', args=[self.course.id])
+        self.client.login(username='student', password='secret')
+
+    def test_only_enrolled_students(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_pages_backwards(self):
+        self.course.students.add(self.user)
+        now = timezone.now()
+        ChatMessage.objects.bulk_create([ChatMessage(course=self.course, user=self.user, content=str(i),
+                                                     sent_on=now + timedelta(seconds=i // 2))
+                                         for i in range(HISTORY_SIZE + 10)])
+        page = self.client.get(self.url).json()
+        self.assertEqual(page['messages'][0]['message'], str(HISTORY_SIZE + 9))
+        self.assertEqual(len(page['messages']), HISTORY_SIZE)
+        older = self.client.get(self.url, {'before': page['next']}).json()
+        self.assertEqual([m['message'] for m in older['messages']], [str(i) for i in range(9, -1, -1)])
+        self.assertIsNone(older['next'])
+
+
+class ChatQueryBudgetTests(ChatTestMixin, QueryBudgetMixin, TestCase):
+    def test_views(self):
+        self.course.students.add(self.user)
+        self.client.login(username='student', password='secret')
+        self.assertWithinQueryBudget(self.client.get(reverse('chat:course_chat_room', args=[self.course.id])))
+        self.assertWithinQueryBudget(self.client.get(reverse('chat:course_chat_history', args=[self.course.id])))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BenchmarkCommandTests(TransactionTestCase):
+    def test_fanout_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_chat_fanout', clients=3, messages=1, stdout=out)
+        self.assertIn('3 deliveries', out.getvalue())
+        self.assertFalse(User.objects.exists())
+
+    def test_connect_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_chat_connect', connects=2, stdout=out)
+        self.assertIn('with cache', out.getvalue())
+        self.assertFalse(User.objects.exists())
@@ -5,5 +5,6 @@ app_name = 'chat'
 
 urlpatterns = [
     path('room/<int:course_id>/', views.course_chat_room, name='course_chat_room'),
+    path('room/<int:course_id>/history/', views.course_chat_history, name='course_chat_history'),
 ]
 
@@ -1,25 +1,56 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseForbidden
-from django.contrib.auth.decorators import login_required, permission_required
-from rest_framework.response import Response
-from rest_framework import status
+from django.http import HttpResponseForbidden, HttpResponseBadRequest, JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.db.models import Q
+from .models import ChatMessage
+from django.contrib.auth.decorators import login_required
+from courses.enrollment import is_enrolled
+from courses.models import Course
+from educa.metrics import query_budget
 
+HISTORY_SIZE = 50  # messages per page of history
 
+
+@query_budget(4)  # session, user, enrollments on a cache miss and course
 @login_required
 def course_chat_room(request, course_id):
-    try:
-        # retrieve course with given id enrolled by the current user
-        course = request.user.courses_joined.get(id=course_id)
-        if not course:
-            return Response({'status': 404, 'success': False,
-                             'message': 'Course object not found'},
-                            status=status.HTTP_404_NOT_FOUND)
-    except Exception:
+    # only students enrolled on the course, checked against the cached enrollment index
+    if not is_enrolled(request.user, course_id):
         # user is not an enrolled student of the course or course doesn't exist
-        return Response({'status': 403, 'success': False,
-                         'message': 'User is not an enrolled student for the course'},
-                        status=status.HTTP_403_FORBIDDEN)
+        return HttpResponseForbidden('User is not an enrolled student for the course')
+    course = get_object_or_404(Course, id=course_id)
     return render(request, 'chat/room.html', {'course': course})
 
 
+def make_cursor(message):
+    return f"{message['sent_on'].isoformat()},{message['id']}"
+
 
+@query_budget(4)  # session, user, enrollments on a cache miss and messages
+@login_required
+def course_chat_history(request, course_id):
+    """Returns the latest messages of a course's chat room, newest first.
+    Older pages are requested with ?before=<cursor>, using the 'next' cursor of the previous page."""
+    if not is_enrolled(request.user, course_id):
+        return HttpResponseForbidden('User is not an enrolled student for the course')
+    messages = ChatMessage.objects.filter(course_id=course_id)
+    before = request.GET.get('before')
+    if before:
+        # keyset pagination: messages sent before the (sent_on, id) of the cursor, served by a single index
+        try:
+            sent_on, id = before.rsplit(',', 1)
+            sent_on, id = parse_datetime(sent_on), int(id)
+        except ValueError:
+            sent_on = None
+        if sent_on is None:
+            return HttpResponseBadRequest('Invalid cursor')
+        messages = messages.filter(Q(sent_on__lt=sent_on) | Q(sent_on=sent_on, id__lt=id))
+    page = list(messages.order_by('-sent_on', '-id')
+                .values('id', 'content', 'sent_on', 'user__username')[:HISTORY_SIZE])
+    return JsonResponse({
+        'messages': [{'id': message['id'],
+                      'message': message['content'],
+                      'user': message['user__username'],
+                      'datetime': message['sent_on'].isoformat()} for message in page],
+        'next': make_cursor(page[-1]) if len(page) == HISTORY_SIZE else None,
+    })
@@ -0,0 +1,39 @@
+"""
+Precomputed payloads of the course 'contents' API action.
+The serialized module -> content -> item tree of a course is rendered to JSON once and cached,
+tagged with the course, together with a strong ETag computed from the JSON bytes.
+Any change to the course, its modules, contents or items bumps the course tag (see signals.py).
+"""
+import hashlib
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+from .. import cache_tags
+from ..cache_tags import tag_for
+from ..models import Course, Content
+from .serializers import CourseWithContentsSerializer
+from .selection import FieldSelection
+
+
+def build_course_contents(course_id, selection=None):
+    """Returns (etag, json) of the course contents, in a fixed number of queries.
+    Only the relations in the selection are loaded, and the items are only rendered if requested."""
+    selection = selection or FieldSelection()
+    course = Course.objects.all()
+    if selection.expands('modules.contents.item'):
+        course = course.prefetch_related(Prefetch('modules__contents', queryset=Content.objects.with_items()))
+    elif selection.expands('modules.contents'):
+        course = course.prefetch_related('modules__contents')
+    elif selection.expands('modules'):
+        course = course.prefetch_related('modules')
+    course = course.get(pk=course_id)
+    data = CourseWithContentsSerializer(course, context={'selection': selection}).data
+    body = JSONRenderer().render(data)
+    return f'"{hashlib.sha256(body).hexdigest()}"', body
+
+
+def get_course_contents(course_id, selection=None):
+    selection = selection or FieldSelection()
+    # every selection of fields is a different payload
+    key = f'course_contents:{course_id}:{hashlib.md5(selection.key().encode()).hexdigest()}'
+    return cache_tags.get_or_compute_entry(key, [tag_for(Course, course_id)],
+                                           lambda: build_course_contents(course_id, selection))
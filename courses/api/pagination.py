@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CourseCursorPagination(CursorPagination):
+    """Keyset pagination over (created, id): every page is a single indexed query,
+    however deep the client pages into the catalog."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created', '-id')
@@ -1,10 +1,11 @@
 from rest_framework.permissions import BasePermission
+from ..enrollment import is_enrolled
 
 
 class IsEnrolled(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.students.filter(id=request.user.id).exists()
-        # to confirm that the current user requesting is already enrolled
+        return is_enrolled(request.user, obj.id)
+        # to confirm that the current user requesting is already enrolled, from the cached enrollment index
 
 
 
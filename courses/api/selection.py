@@ -0,0 +1,69 @@
+class FieldSelection:
+    """
+    Fields and nested relations requested with the ?fields= and ?expand= query parameters.
+
+        ?fields=id,title,modules.title   only these fields, nested fields are prefixed with their path
+        ?expand=modules.contents         only these nested relations (and their parents), ?expand= for none
+
+    Without a parameter every field, or every nested relation, is included.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = None  # {path: set of field names}
+        if fields is not None:
+            self.fields = {}
+            for field in filter(None, fields.split(',')):
+                parts = field.strip().split('.')
+                # a nested field selects its parents: 'modules.title' selects 'modules'
+                for i, name in enumerate(parts):
+                    self.fields.setdefault('.'.join(parts[:i]), set()).add(name)
+        self.expand = None  # set of nested paths
+        if expand is not None:
+            self.expand = set()
+            for path in filter(None, expand.split(',')):
+                parts = path.strip().split('.')
+                # expanding a relation expands its parents
+                self.expand.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(request.query_params.get('fields'), request.query_params.get('expand'))
+
+    def includes(self, path, nested=False):
+        """Whether the field at the given path, e.g. 'modules.title', is requested."""
+        parts = path.split('.')
+        if self.fields is not None:
+            for i, name in enumerate(parts):
+                level = '.'.join(parts[:i])
+                if level in self.fields and name not in self.fields[level]:
+                    return False
+        return not nested or self.expand is None or path in self.expand
+
+    def expands(self, path):
+        """Whether the nested relation at the given path and all its parents are requested,
+        used to decide what to prefetch."""
+        parts = path.split('.')
+        return all(self.includes('.'.join(parts[:i]), nested=True) for i in range(1, len(parts) + 1))
+
+    def key(self):
+        """Identifies the selection, for caching the payloads built with it."""
+        fields = None if self.fields is None else sorted(f'{path}.{name}' if path else name
+                                                         for path, names in self.fields.items()
+                                                         for name in names)
+        expand = None if self.expand is None else sorted(self.expand)
+        return f'fields={fields}&expand={expand}'
+
+
+class SelectableFieldsMixin:
+    """Serializer mixin dropping the fields that aren't in the FieldSelection of the context."""
+    path = ''  # path of the serialized objects from the course, e.g. 'modules'
+    nested_fields = ()  # fields that are only included when expanded
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.context.get('selection')
+        if selection is None:
+            return fields
+        prefix = f'{self.path}.' if self.path else ''
+        return {name: field for name, field in fields.items()
+                if selection.includes(prefix + name, nested=name in self.nested_fields)}
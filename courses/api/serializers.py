@@ -1,26 +1,31 @@
 from rest_framework import serializers
-from ..models import Subject, Course, Module, Content
+from ..models import Subject, Course, Module, Content, Upload
+from .selection import SelectableFieldsMixin
+from . import uploads
 
 
 class SubjectSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subject
-        fields = '__all__'
+        fields = ['id', 'title', 'slug', 'total_courses']
 
 
-class ModuleSerializer(serializers.ModelSerializer):
+class ModuleSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
+    path = 'modules'
+
     class Meta:
         model = Module
         fields = ['order', 'title', 'description']
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     modules = ModuleSerializer(many=True, read_only=True)
+    nested_fields = ('modules',)
 
     class Meta:
         model = Course
-        fields = ['id', 'subject', 'title', 'slug',
-                  'overview', 'created', 'owner', 'modules']
+        fields = ['id', 'subject', 'title', 'slug', 'overview', 'created', 'owner',
+                  'total_modules', 'total_students', 'modules']
 
 
 class ItemRelatedField(serializers.RelatedField):
@@ -28,27 +33,56 @@ class ItemRelatedField(serializers.RelatedField):
         return value.render()
 
 
-class ContentSerializer(serializers.ModelSerializer):
+class ContentSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     item = ItemRelatedField(read_only=True)
+    path = 'modules.contents'
+    nested_fields = ('item',)  # rendering the item is the most expensive part
 
     class Meta:
         model = Content
         fields = ['order', 'item']
 
 
-class ModuleWithContentSerializer(serializers.ModelSerializer):
+class ModuleWithContentSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     contents = ContentSerializer(many=True)
+    path = 'modules'
+    nested_fields = ('contents',)
 
     class Meta:
         model = Module
         fields = ['order', 'title', 'description', 'contents']
 
 
-class CourseWithContentsSerializer(serializers.ModelSerializer):
+class CourseWithContentsSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     modules = ModuleWithContentSerializer(many=True)
+    nested_fields = ('modules',)
 
     class Meta:
         model = Course
         fields = ['id', 'subject', 'title', 'slug',
                   'overview', 'created', 'owner', 'modules']
 
+
+class UploadSerializer(serializers.ModelSerializer):
+    offset = serializers.IntegerField(source='received', read_only=True)
+
+    class Meta:
+        model = Upload
+        fields = ['id', 'module', 'model_name', 'title', 'filename', 'size', 'checksum', 'chunk_size', 'offset']
+        read_only_fields = ['chunk_size']
+
+    def validate_module(self, module):
+        if module.course.owner_id != self.context['request'].user.id:
+            raise serializers.ValidationError('Contents can only be added to the modules of your courses.')
+        return module
+
+    def validate_size(self, size):
+        if size > uploads.MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(f'Files are limited to {uploads.MAX_UPLOAD_SIZE} bytes.')
+        return size
+
+    def validate_checksum(self, checksum):
+        checksum = checksum.lower()
+        if len(checksum) != 64 or any(c not in '0123456789abcdef' for c in checksum):
+            raise serializers.ValidationError('Expected the SHA-256 of the file, in hexadecimal.')
+        return checksum
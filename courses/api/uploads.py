@@ -0,0 +1,148 @@
+"""
+Chunked, resumable uploads of File and Image contents.
+POST api/uploads/ declares the file (module, model_name, title, filename, size and SHA-256 checksum)
+and returns its id and chunk_size. The file is then sent in order with PUT api/uploads/<id>/chunk/?offset=<n>,
+one chunk of chunk_size bytes per request (the last one may be shorter). After an interruption,
+GET api/uploads/<id>/ returns the offset to resume from. POST api/uploads/<id>/complete/ verifies the
+checksum and creates the item and its Content like ContentCreateUpdateView does.
+Chunks are streamed to a temporary file, at most COPY_SIZE bytes are held in memory at once.
+The upload row is locked only to check a request and to record its result: chunks are written and the
+file is stored as a blob in between, so a slow client doesn't hold a transaction open.
+Uploads not completed within UPLOAD_TTL are discarded by the expire_uploads management command.
+"""
+import os
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+from ..models import Blob, Content, Upload
+from ..storage import blob_storage, get_digest
+
+CHUNK_SIZE = 8 * 1024 * 1024
+COPY_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024 * 1024
+UPLOAD_TTL = timedelta(days=1)
+
+
+class UploadError(Exception):
+    pass
+
+
+def get_directory():
+    return settings.CHUNKED_UPLOAD_DIR
+
+
+def temp_path(upload):
+    return os.path.join(get_directory(), f'{upload.id}.part')
+
+
+def start(upload):
+    os.makedirs(get_directory(), exist_ok=True)
+    open(temp_path(upload), 'wb').close()
+
+
+def discard(upload):
+    path = temp_path(upload)  # delete() clears the id
+    upload.delete()
+    transaction.on_commit(lambda: os.path.exists(path) and os.remove(path))
+
+
+def expire(ttl=UPLOAD_TTL):
+    """Discards the uploads started more than ttl ago, and the temporary files left without an upload
+    (e.g. after their module was deleted). Returns the number of uploads discarded."""
+    expired = list(Upload.objects.filter(created__lt=timezone.now() - ttl))
+    for upload in expired:
+        discard(upload)
+    directory = get_directory()
+    if os.path.isdir(directory):
+        ids = {str(id) for id in Upload.objects.values_list('id', flat=True)}
+        cutoff = time.time() - ttl.total_seconds()
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            upload_id, extension = os.path.splitext(name)
+            if extension == '.part' and upload_id not in ids and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    return len(expired)
+
+
+def check_chunk(upload, offset, length):
+    """Returns whether the chunk sent at offset is to be written, raises UploadError when it doesn't
+    fit. The upload row must be locked."""
+    if offset + length <= upload.received and length:
+        return False  # sent again after its response was lost, already written
+    if offset != upload.received:
+        raise UploadError(f'Expected the chunk at offset {upload.received}')
+    last = offset + length == upload.size
+    if length > upload.chunk_size or (length != upload.chunk_size and not last) or offset + length > upload.size:
+        raise UploadError(f'Chunks must be {upload.chunk_size} bytes, except the last one')
+    return True
+
+
+def write_chunk(upload, offset, stream, length):
+    """Writes the chunk checked by check_chunk(), without holding the lock of the upload."""
+    try:
+        temp_file = open(temp_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('The upload was completed or discarded meanwhile')
+    with temp_file:
+        # a chunk interrupted before, or being sent again by a retry, is simply overwritten. The file is
+        # never truncated: a retry finishing late would cut the chunks written after it.
+        temp_file.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_SIZE, remaining))
+            if not data:
+                raise UploadError('The chunk is shorter than its Content-Length')
+            temp_file.write(data)
+            remaining -= len(data)
+
+
+def advance(upload, offset, length):
+    """Moves the upload past the chunk written at offset. The upload row must be locked again: a retry
+    of the same chunk may have moved it already."""
+    if check_chunk(upload, offset, length):
+        upload.received = offset + length
+        upload.save(update_fields=['received'])
+
+
+def check_complete(upload):
+    """The upload row must be locked."""
+    if upload.received != upload.size:
+        raise UploadError(f'{upload.size - upload.received} bytes are missing')
+
+
+def store(upload):
+    """Stores the received file as a blob, without holding the lock of the upload, returns its name."""
+    try:
+        temp_file = open(temp_path(upload), 'rb')
+    except FileNotFoundError:
+        raise UploadError('The upload was completed or discarded meanwhile')
+    with temp_file:
+        return blob_storage.save(upload.filename, DjangoFile(temp_file, name=upload.filename))
+
+
+def complete(upload, name):
+    """Creates the item of the stored blob and its Content, returns the Content. The upload row must be
+    locked again, the blob is deleted if it isn't the file declared by the checksum."""
+    check_complete(upload)
+    if get_digest(name) != upload.checksum:
+        # start over, a chunk was corrupted on its way
+        upload.received = 0
+        upload.save(update_fields=['received'])
+        transaction.on_commit(lambda: Blob.objects.delete_unreferenced(name))
+        raise UploadError('The checksum of the received file does not match')
+    model = apps.get_model(app_label='courses', model_name=upload.model_name)
+    obj = model(title=upload.title, owner=upload.owner)
+    obj.file = name  # assigned once initialized, so that it's referenced when saved
+    try:
+        with transaction.atomic():
+            obj.save()
+    except FileNotFoundError:
+        # the blob was released by its last other item since store()
+        raise UploadError('The received file was deleted meanwhile, complete the upload again')
+    content = Content.objects.create(module=upload.module, item=obj)
+    discard(upload)
+    return content
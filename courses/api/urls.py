@@ -1,14 +1,19 @@
 from django.urls import path, include
 from rest_framework import routers
+from rest_framework.authtoken.views import obtain_auth_token
 from . import views
 
 # app_name = 'courses'
 router = routers.DefaultRouter()
 router.register('courses', views.CourseViewSet)
+router.register('uploads', views.UploadViewSet, basename='upload')
 # to register the viewset with the 'courses' prefix
 
 urlpatterns = [
     path('', include(router.urls)),
+    # POST username and password to obtain the token used by the authenticated endpoints
+    path('token/', obtain_auth_token, name='api_token'),
+    path('token/revoke/', views.TokenRevokeView.as_view(), name='api_token_revoke'),
 ]
 
 # urlpatterns = [
@@ -5,12 +5,25 @@ from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from ..models import Course
-from rest_framework.authentication import BasicAuthentication
+from .authentication import CachedTokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from .permissions import IsEnrolled
 from .serializers import CourseWithContentsSerializer
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from django.utils.http import parse_etags
+from .pagination import CourseCursorPagination
+from .contents import get_course_contents
+from .selection import FieldSelection
+from ..search import search_courses
+from rest_framework import mixins, status
+from rest_framework.authentication import SessionAuthentication
+from django.db import transaction
+from ..models import Upload
+from .serializers import UploadSerializer
+from . import uploads
 
 
 class SubjectListView(generics.ListAPIView):
@@ -25,8 +38,18 @@ class SubjectDetailView(generics.RetrieveAPIView):
 
 
 # all the information about authentication at: https://www.djangorest-framework.org/api-guide/authentication/
+class TokenRevokeView(APIView):
+    """Revokes the token used to authenticate the request. A new one is obtained from api/token/"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, format=None):
+        request.auth.delete()
+        return Response({'revoked': True})
+
+
 class CourseEnrollView(APIView):
-    authentication_classes = (BasicAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def post(self, request, pk, format=None):
@@ -35,19 +58,161 @@ class CourseEnrollView(APIView):
         return Response({'enrolled': True})
 
 
+EXPORT_CHUNK_SIZE = 500  # courses loaded per query by the export action
+
+
 class CourseViewSet(viewsets.ReadOnlyModelViewSet):
     # provide only read actions-list and retrieve
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = CourseCursorPagination
+    # token, course, enrollments and, on a cache miss of the contents,
+    # course, modules, contents and one query per type of item
+    query_budget = 10
+
+    def get_selection(self):
+        # the fields and nested relations requested with ?fields= and ?expand=
+        return FieldSelection.from_request(self.request)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['selection'] = self.get_selection()
+        return context
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'contents':
+            # only needed for the permission checks, the contents are served precomputed
+            return qs
+        if self.get_selection().expands('modules'):
+            # modules are nested in the serialized courses, load them in a single query
+            qs = qs.prefetch_related('modules')
+        return qs
+
+    def iter_courses(self):
+        """Yields every course, loading them in chunks of EXPORT_CHUNK_SIZE by id (keyset),
+        so only one chunk and its modules are held in memory at a time."""
+        qs = self.get_queryset().order_by('id')
+        last_id = 0
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:EXPORT_CHUNK_SIZE])
+            if not chunk:
+                return
+            yield from chunk
+            last_id = chunk[-1].id
+
+    def stream_courses(self, ndjson):
+        renderer = JSONRenderer()
+        context = self.get_serializer_context()
+        separator = b'\n' if ndjson else b','
+        if not ndjson:
+            yield b'['
+        for i, course in enumerate(self.iter_courses()):
+            data = renderer.render(self.get_serializer_class()(course, context=context).data)
+            yield data + separator if ndjson else (separator if i else b'') + data
+        if not ndjson:
+            yield b']'
+
+    @action(detail=False)
+    def search(self, request, *args, **kwargs):
+        """Courses matching ?q=, best match first, see courses/search.py"""
+        ids = search_courses(request.query_params.get('q', ''))
+        courses = {course.id: course for course in self.get_queryset().filter(id__in=ids)}
+        serializer = self.get_serializer([courses[id] for id in ids if id in courses], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        """Streams the whole catalog as a JSON array, or one JSON course per line with ?ndjson=1.
+        Accepts ?fields= and ?expand= like the list."""
+        ndjson = request.query_params.get('ndjson') in ('1', 'true')
+        return StreamingHttpResponse(self.stream_courses(ndjson),
+                                     content_type='application/x-ndjson' if ndjson else 'application/json')
 
     @action(detail=True, methods=['get', 'post'],
             serializer_class=CourseWithContentsSerializer,
-            authentication_classes=[BasicAuthentication],
+            authentication_classes=[CachedTokenAuthentication],
             permission_classes=[IsAuthenticated, IsEnrolled])
     def contents(self, request, *args, **kwargs):
-        return self.retrieve(request, *args, **kwargs)
+        course = self.get_object()
+        etag, body = get_course_contents(course.id, self.get_selection())
+        # clients that already have the current version get a 304 without any serialization work
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
     # def enroll(self, request, *args, **kwargs):
     #     course = self.get_object()
     #     course.student.add(request.user)
     #     return Response({'enrolled': True})
+
+
+def conflict(error, upload):
+    # the offset tells the client where to resume from
+    return Response({'detail': str(error), 'offset': upload.received}, status=status.HTTP_409_CONFLICT)
+
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                    viewsets.GenericViewSet):
+    """Chunked, resumable uploads of File and Image contents, see uploads.py"""
+    serializer_class = UploadSerializer
+    authentication_classes = (SessionAuthentication, CachedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Upload.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        uploads.start(serializer.save(owner=self.request.user, chunk_size=uploads.CHUNK_SIZE))
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+
+    def get_locked_upload(self):
+        # serializes the checks and updates of an upload, held while no file is written
+        return get_object_or_404(self.get_queryset().select_for_update(), pk=self.kwargs['pk'])
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, *args, **kwargs):
+        """The chunk starting at ?offset=, as the raw request body"""
+        try:
+            offset = int(request.query_params['offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'offset and Content-Length are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                upload = self.get_locked_upload()
+                if not uploads.check_chunk(upload, offset, length):
+                    return Response({'offset': upload.received})
+            uploads.write_chunk(upload, offset, request.stream, length)
+            with transaction.atomic():
+                upload = self.get_locked_upload()
+                uploads.advance(upload, offset, length)
+        except uploads.UploadError as e:
+            return conflict(e, upload)
+        return Response({'offset': upload.received})
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, *args, **kwargs):
+        with transaction.atomic():
+            upload = self.get_locked_upload()
+            try:
+                uploads.check_complete(upload)
+            except uploads.UploadError as e:
+                return conflict(e, upload)
+        try:
+            name = uploads.store(upload)
+        except uploads.UploadError as e:
+            return conflict(e, upload)
+        with transaction.atomic():
+            upload = self.get_locked_upload()  # a concurrent request may have completed it meanwhile
+            try:
+                content = uploads.complete(upload, name)
+            except uploads.UploadError as e:
+                return conflict(e, upload)  # in the transaction, a checksum mismatch restarts the upload
+        return Response({'content': content.id, 'file': content.item.file.url}, status=status.HTTP_201_CREATED)
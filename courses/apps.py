@@ -5,5 +5,6 @@ class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
 
-
-
+    def ready(self):
+        # register the signal receivers
+        from . import signals  # noqa: F401
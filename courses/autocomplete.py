@@ -0,0 +1,141 @@
+"""
+In-memory prefix index for the search-as-you-type box of the course list.
+Subjects and courses are indexed under their full title, every word of their title and their slug.
+Each node of the trie keeps the TOP_K best entries of its subtree, so a lookup only walks the prefix.
+The index of a process is updated by the receivers in signals.py once a change commits, and rebuilt
+when the catalog tag shows that another process changed the catalog.
+"""
+import re
+import threading
+from collections import namedtuple
+from django.urls import reverse
+from . import cache_tags
+from .catalog import CATALOG_TAG
+from .models import Subject, Course
+
+TOP_K = 10
+
+Entry = namedtuple('Entry', ['rank', 'kind', 'id', 'title', 'url'])
+
+
+def make_entry(obj):
+    if isinstance(obj, Subject):
+        url = reverse('course_list_subject', args=[obj.slug])
+        kind = 'subject'
+    else:
+        url = reverse('course_detail', args=[obj.slug])
+        kind = 'course'
+    # subjects before courses, then alphabetically
+    return Entry((kind != 'subject', obj.title.lower()), kind, obj.id, obj.title, url)
+
+
+def get_keys(obj):
+    title = obj.title.lower()
+    return {title, obj.slug.lower(), *re.findall(r'\w+', title)}
+
+
+class Node:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()  # entries with a key ending at this node
+        self.top = []  # best TOP_K entries of the subtree, sorted by rank
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.root = Node()
+        self.keys = {}  # (kind, id) -> keys, to remove an entry
+        self.lock = threading.Lock()
+
+    def add(self, obj):
+        entry, keys = make_entry(obj), get_keys(obj)
+        with self.lock:
+            self._remove((entry.kind, entry.id))
+            self.keys[(entry.kind, entry.id)] = (entry, keys)
+            for key in keys:
+                node = self.root
+                path = [node]
+                for char in key:
+                    node = node.children.setdefault(char, Node())
+                    path.append(node)
+                node.entries.add(entry)
+                for node in path:
+                    if entry not in node.top:
+                        node.top = sorted(node.top + [entry])[:TOP_K]
+
+    def remove(self, kind, id):
+        with self.lock:
+            self._remove((kind, id))
+
+    def _remove(self, identity):
+        if identity not in self.keys:
+            return
+        entry, keys = self.keys.pop(identity)
+        for key in keys:
+            path = [self.root]
+            for char in key:
+                path.append(path[-1].children[char])
+            path[-1].entries.discard(entry)
+            # recompute the top entries bottom-up, from the entries and the children's top entries
+            for node in reversed(path):
+                if entry in node.top:
+                    candidates = set(node.entries)
+                    for child in node.children.values():
+                        candidates.update(child.top)
+                    node.top = sorted(candidates)[:TOP_K]
+
+    def lookup(self, prefix, limit=TOP_K):
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+
+class Autocomplete:
+    """The prefix index of the process, built from the catalog on first use."""
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def current_version(self):
+        return cache_tags.get_versions([CATALOG_TAG])[0]
+
+    def get_index(self):
+        version = self.current_version()
+        if self.index is None or version != self.version:
+            # first use, or the catalog was changed by another process
+            with self.lock:
+                if self.index is not None and self.version == version:
+                    return self.index  # rebuilt by the thread this one waited for
+                index = PrefixIndex()
+                for obj in list(Subject.objects.only('id', 'title', 'slug')) + \
+                        list(Course.objects.only('id', 'title', 'slug')):
+                    index.add(obj)
+                self.index, self.version = index, version
+        return self.index
+
+    def lookup(self, prefix, limit=TOP_K):
+        return self.get_index().lookup(prefix.strip(), limit)
+
+    def update(self, obj):
+        """Applies a change made by this process once it's committed, after the catalog tag is bumped."""
+        if self.index is None:
+            return
+        self.index.add(obj)
+        self.version = self.current_version()
+
+    def remove(self, kind, id):
+        """Applies a deletion made by this process once it's committed."""
+        if self.index is None:
+            return
+        self.index.remove(kind, id)
+        self.version = self.current_version()
+
+
+autocomplete = Autocomplete()
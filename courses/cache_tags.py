@@ -0,0 +1,82 @@
+"""
+Tag-based cache invalidation.
+Every cache entry is stored under a key that embeds the current version of each tag it depends on,
+e.g. 'course:12' or 'module:7'. Bumping a tag's version (see signals.py) makes every entry built
+against the old version unreachable at once, so entries can have long timeouts and still never go stale.
+"""
+import hashlib
+import time
+from django.core.cache import cache
+from . import stampede
+
+DEFAULT_TIMEOUT = 60 * 60 * 6  # entries are invalidated by tag, the timeout only bounds memory usage
+# Prefix of the keys of tagged entries. Their value never changes once written, which lets
+# educa.cache.TwoTierCache keep them in process memory (see L1_KEY_PREFIXES in settings.py):
+# the values read back are shared and must not be modified.
+VERSIONED_PREFIX = 'tagged:'
+
+
+def tag_for(model, pk):
+    """Builds the tag of a model instance, e.g. tag_for(Course, 12) -> 'course:12'"""
+    return f'{model._meta.model_name}:{pk}'
+
+
+def tag_for_object(obj):
+    return tag_for(obj, obj.pk)
+
+
+def version_key(tag):
+    return f'tag_version:{tag}'
+
+
+def new_version():
+    # Versions start from the current time, so a tag whose version was evicted from the cache
+    # never comes back to a value that older entries were stored under.
+    return time.time_ns()
+
+
+def get_versions(tags):
+    """Returns the current version of each tag, with one cache round trip."""
+    keys = [version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def key_suffix(tags):
+    """Digest of the current versions of the given tags, changes as soon as one of them is bumped."""
+    tags = sorted(set(tags))
+    versions = ','.join(f'{tag}={version}' for tag, version in zip(tags, get_versions(tags)))
+    return hashlib.md5(versions.encode()).hexdigest()
+
+
+def make_key(key, tags):
+    """Returns the key under which an entry depending on the given tags is stored right now."""
+    return f'{VERSIONED_PREFIX}{key}:{key_suffix(tags)}'
+
+
+def get_entry(key, tags, default=None):
+    return cache.get(make_key(key, tags), default)
+
+
+def set_entry(key, value, tags, timeout=DEFAULT_TIMEOUT):
+    cache.set(make_key(key, tags), value, timeout)
+
+
+def get_or_compute_entry(key, tags, compute, timeout=DEFAULT_TIMEOUT):
+    """Returns the entry, computing it once however many requests miss it together (see stampede.py)."""
+    return stampede.get_or_compute(make_key(key, tags), compute, timeout)
+
+
+def invalidate(*tags):
+    """Bumps the version of the given tags, making every entry that depends on them stale."""
+    for tag in tags:
+        key = version_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the version was evicted or never set
+            cache.set(key, new_version(), None)
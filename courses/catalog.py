@@ -0,0 +1,64 @@
+"""
+Compact, precomputed snapshot of the course catalog used by CourseListView.
+Instead of caching querysets (pickled as full model instances), the catalog is built in two queries
+and stored as lightweight rows: one list for all subjects, one for the whole catalog and one per subject.
+"""
+from collections import namedtuple
+from .models import Subject, Course
+from . import cache_tags, stampede
+
+# Bump when the row layout changes, so entries written by older code are never read back.
+CATALOG_LAYOUT = 1
+CATALOG_TIMEOUT = cache_tags.DEFAULT_TIMEOUT
+# Every catalog entry depends on this tag, bumped whenever a subject, course or module changes.
+CATALOG_TAG = 'catalog'
+
+SubjectRow = namedtuple('SubjectRow', ['id', 'slug', 'title', 'total_courses'])
+CourseRow = namedtuple('CourseRow', ['id', 'slug', 'title', 'subject_id', 'subject_slug',
+                                     'subject_title', 'owner', 'total_modules'])
+
+
+def make_key(name, suffix):
+    return f'{cache_tags.VERSIONED_PREFIX}catalog:{CATALOG_LAYOUT}:{name}:{suffix}'
+
+
+def invalidate():
+    cache_tags.invalidate(CATALOG_TAG)
+
+
+def build_catalog():
+    """Returns {name: rows} for the subjects, the whole catalog and each subject, using two queries.
+    The totals are read from the counters kept by counters.py, without grouping over the related tables."""
+    subjects = [SubjectRow(*values) for values in
+                Subject.objects.values_list('id', 'slug', 'title', 'total_courses')]
+    courses = [CourseRow(*values) for values in
+               Course.objects.values_list('id', 'slug', 'title', 'subject_id', 'subject__slug',
+                            'subject__title', 'owner__username', 'total_modules')]
+    catalog = {'subjects': subjects, 'courses': courses}
+    for subject in subjects:
+        catalog[f'subject_{subject.id}_courses'] = [course for course in courses
+                                                    if course.subject_id == subject.id]
+    return catalog
+
+
+def get_catalog_entry(name):
+    suffix = cache_tags.key_suffix([CATALOG_TAG])
+
+    def compute():
+        # rebuild the whole snapshot at once, every entry costs the same two queries
+        catalog = build_catalog()
+        stampede.set_many({make_key(key, suffix): value for key, value in catalog.items() if key != name},
+                          CATALOG_TIMEOUT)
+        return catalog.get(name, [])
+    # a single request rebuilds a missing or expiring snapshot, the others wait for it or get the previous one
+    return stampede.get_or_compute(make_key(name, suffix), compute, CATALOG_TIMEOUT)
+
+
+def get_subjects():
+    return get_catalog_entry('subjects')
+
+
+def get_courses(subject_id=None):
+    if subject_id is None:
+        return get_catalog_entry('courses')
+    return get_catalog_entry(f'subject_{subject_id}_courses')
@@ -0,0 +1,67 @@
+"""
+Denormalized counters: the number of courses of each subject, and of modules and students of each course.
+The receivers in signals.py keep them current with atomic F() updates, so the catalog and the API
+read a column instead of grouping over the related tables. Changes made without signals
+(bulk operations, raw SQL, cascades) can make them drift, reconcile() repairs them.
+"""
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from .models import Subject, Course, Module
+
+Enrollment = Course.students.through
+
+# counter field -> (model holding the counter, counted model, foreign key of the counted model)
+COUNTERS = {
+    'total_courses': (Subject, Course, 'subject'),
+    'total_modules': (Course, Module, 'course'),
+    'total_students': (Course, Enrollment, 'course'),
+}
+# counted model -> (foreign key attname, counter field of the parent)
+PARENTS = {
+    Course: ('subject_id', 'total_courses'),
+    Module: ('course_id', 'total_modules'),
+}
+
+
+def adjust(field, pks, delta):
+    """Adds delta to the counter of the given rows, in a single UPDATE."""
+    model = COUNTERS[field][0]
+    pks = [pk for pk in pks if pk is not None]
+    if pks and delta:
+        # a counter that drifted below the actual count must not fail the write that decrements it
+        model.objects.filter(pk__in=pks).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(field):
+    """Subquery counting the related rows of each row of the counter's model."""
+    model, counted, foreign_key = COUNTERS[field]
+    counts = counted.objects.filter(**{foreign_key: OuterRef('pk')}).order_by()\
+        .values(foreign_key).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts), 0)
+
+
+def recount(field, pks=None):
+    """Sets the counter of the given rows (all rows by default) to the actual count."""
+    model = COUNTERS[field][0]
+    rows = model.objects.all() if pks is None else model.objects.filter(pk__in=pks)
+    return rows.update(**{field: actual_count(field)})
+
+
+def find_drift(field):
+    """Returns the pks of the rows whose counter differs from the actual count."""
+    model = COUNTERS[field][0]
+    return list(model.objects.annotate(actual=actual_count(field)).exclude(**{field: F('actual')})
+                .values_list('pk', flat=True))
+
+
+def reconcile_field(field):
+    """Repairs the rows whose counter drifted, returns how many there were."""
+    pks = find_drift(field)
+    if pks:
+        recount(field, pks)
+    return len(pks)
+
+
+def reconcile():
+    """Repairs every counter, returns {field: number of repaired rows}."""
+    return {field: reconcile_field(field) for field in COUNTERS}
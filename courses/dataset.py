@@ -0,0 +1,100 @@
+"""
+Deterministic generator of a large catalog, to measure the project at a realistic scale
+(see the generate_catalog and benchmark_views management commands).
+The same arguments and seed always produce the same subjects, courses, modules, contents and enrollments.
+Rows are inserted with bulk_create(), which doesn't send signals: the counters are reconciled and the
+catalog tag is bumped here, the search index is rebuilt by the rebuild_search_index command.
+"""
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from . import counters
+from .catalog import invalidate as invalidate_catalog
+from .models import Subject, Course, Module, Content, Text, Video, Image, File
+
+PASSWORD = 'secret'  # of every generated user
+BATCH_SIZE = 500
+COURSES_PER_BATCH = 100  # the modules and contents of this many courses are held in memory at once
+ITEM_MODELS = (Text, Video, Image, File)
+WORDS = ['django', 'python', 'web', 'design', 'data', 'models', 'views', 'forms', 'testing', 'cache',
+         'security', 'deploy', 'async', 'queries', 'templates', 'api', 'search', 'images', 'files', 'chat']
+
+
+def make_title(rng, words=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def make_item(model, rng, owner, number):
+    title = f'{make_title(rng)} {number}'
+    if model is Text:
+        item = Text(owner=owner, title=title, content=' '.join(rng.choice(WORDS) for _ in range(40)))
+    elif model is Video:
+        item = Video(owner=owner, title=title, url=f'https://www.youtube.com/watch?v={rng.getrandbits(40):010x}')
+    else:
+        # the files don't exist, the items only reference them
+        item = model(owner=owner, title=title, file=f'{model._meta.model_name}s/generated-{number}.bin')
+    # bulk_create() doesn't call save(), which stores the rendered HTML
+    item.rendered = item.render_template()
+    item.rendered_version = model.RENDER_VERSION
+    return item
+
+
+def create_users(prefix, role, count, password):
+    return User.objects.bulk_create([User(username=f'{prefix}-{role}-{i}', password=password)
+                                     for i in range(count)], batch_size=BATCH_SIZE)
+
+
+def create_contents(courses, rng, modules, contents):
+    """Creates the modules of the courses and the contents of each module, one bulk_create per model."""
+    module_rows = Module.objects.bulk_create(
+        [Module(course=course, title=make_title(rng), description=make_title(rng, 12), order=order)
+         for course in courses for order in range(modules)], batch_size=BATCH_SIZE)
+    owners = {course.id: course.owner for course in courses}
+    items = {model: [] for model in ITEM_MODELS}
+    placements = []  # (module, order, model, index of the item)
+    for module in module_rows:
+        for order in range(contents):
+            model = rng.choice(ITEM_MODELS)
+            placements.append((module, order, model, len(items[model])))
+            items[model].append(make_item(model, rng, owners[module.course_id], len(placements)))
+    for model, rows in items.items():
+        model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    content_types = ContentType.objects.get_for_models(*ITEM_MODELS)
+    Content.objects.bulk_create([Content(module=module, content_type=content_types[model],
+                                         object_id=items[model][index].id, order=order)
+                                 for module, order, model, index in placements], batch_size=BATCH_SIZE)
+    return len(module_rows), len(placements)
+
+
+@transaction.atomic
+def generate(prefix='catalog', subjects=5, courses=50, modules=10, contents=8, students=200,
+             enrollments=3, instructors=10, seed=0):
+    """Generates the catalog, returns the number of rows created per model.
+    'modules' is per course, 'contents' per module and 'enrollments' per student."""
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    instructor_rows = create_users(prefix, 'instructor', instructors, password)
+    student_rows = create_users(prefix, 'student', students, password)
+    subject_rows = Subject.objects.bulk_create(
+        [Subject(title=f'{make_title(rng, 2)} {i}', slug=f'{prefix}-subject-{i}') for i in range(subjects)],
+        batch_size=BATCH_SIZE)
+    course_rows = Course.objects.bulk_create(
+        [Course(owner=instructor_rows[i % instructors], subject=subject_rows[i % subjects],
+                title=f'{make_title(rng)} {i}', slug=f'{prefix}-course-{i}', overview=make_title(rng, 30))
+         for i in range(courses)], batch_size=BATCH_SIZE)
+    total_modules = total_contents = 0
+    for start in range(0, courses, COURSES_PER_BATCH):
+        created = create_contents(course_rows[start:start + COURSES_PER_BATCH], rng, modules, contents)
+        total_modules += created[0]
+        total_contents += created[1]
+    Enrollment = Course.students.through
+    Enrollment.objects.bulk_create([Enrollment(course_id=course.id, user_id=student.id)
+                                    for student in student_rows
+                                    for course in rng.sample(course_rows, min(enrollments, courses))],
+                                   batch_size=BATCH_SIZE)
+    counters.reconcile()
+    invalidate_catalog()
+    return {'users': instructors + students, 'subjects': subjects, 'courses': courses, 'modules': total_modules,
+            'contents': total_contents, 'enrollments': students * min(enrollments, courses)}
@@ -0,0 +1,53 @@
+"""
+Cached enrollment index.
+Holds the ids of the students of each course and the ids of the courses joined by each user, so enrollment
+checks (IsEnrolled, the student views and the chat) don't query the through table of Course.students.
+Entries are built on a miss and removed by the m2m_changed receiver in signals.py as soon as an enrollment changes.
+"""
+from django.core.cache import cache
+from .models import Course
+
+Enrollment = Course.students.through
+ENROLLMENT_TIMEOUT = 60 * 60 * 24
+
+
+def course_students_key(course_id):
+    return f'course_students:{course_id}'
+
+
+def user_courses_key(user_id):
+    return f'user_courses:{user_id}'
+
+
+def get_course_students(course_id):
+    """Returns the ids of the students enrolled on the course."""
+    key = course_students_key(course_id)
+    students = cache.get(key)
+    if students is None:
+        students = frozenset(Enrollment.objects.filter(course_id=course_id)
+                             .values_list('user_id', flat=True))
+        cache.set(key, students, ENROLLMENT_TIMEOUT)
+    return students
+
+
+def get_user_courses(user):
+    """Returns the ids of the courses the user is enrolled on."""
+    if not user.is_authenticated:
+        return frozenset()
+    key = user_courses_key(user.id)
+    courses = cache.get(key)
+    if courses is None:
+        courses = frozenset(Enrollment.objects.filter(user_id=user.id)
+                            .values_list('course_id', flat=True))
+        cache.set(key, courses, ENROLLMENT_TIMEOUT)
+    return courses
+
+
+def is_enrolled(user, course_id):
+    return int(course_id) in get_user_courses(user)
+
+
+def forget(course_ids=(), user_ids=()):
+    cache.delete_many([course_students_key(course_id) for course_id in course_ids] +
+                      [user_courses_key(user_id) for user_id in user_ids])
+
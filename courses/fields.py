@@ -1,35 +1,107 @@
-from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.apps import apps
+from django.db import models, router, transaction, IntegrityError
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
 
 
 class OrderField(models.PositiveIntegerField):
+    """
+    Assigns the next order to new objects with respect to the fields in 'for_fields'.
+    The next free order of each group of objects (e.g. the modules of a course) is kept in an OrderSequence row,
+    which is incremented with a single UPDATE. The update locks the row until the transaction ends,
+    so concurrent inserts never get the same order, and it doesn't need to scan the existing objects.
+    """
+
     def __init__(self, for_fields=None, *args, **kwargs):
         # for_fields'- indicate the fields that the order has to be calculated with respect to.
         self.for_fields = for_fields
         super().__init__(*args, **kwargs)
 
+    @property
+    def reserved_flag(self):
+        # set on instances whose order was already reserved by assign()
+        return f'_{self.attname}_reserved'
+
+    def get_group(self, model_instance):
+        # same-as: the current value of the model fields in for_fields, e.g. {'course_id': 1}
+        attnames = [self.model._meta.get_field(field).attname for field in self.for_fields or []]
+        return {attname: getattr(model_instance, attname) for attname in attnames}
+
+    def get_scope(self, group):
+        values = ','.join(f'{attname}={value}' for attname, value in group.items())
+        return f'{self.model._meta.label_lower}.{self.attname}:{values}'
+
+    def reserve(self, group, count=1):
+        """Reserves 'count' consecutive orders for the given group and returns the first one."""
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        scope = self.get_scope(group)
+        using = router.db_for_write(OrderSequence)
+        sequences = OrderSequence.objects.using(using).filter(scope=scope)
+        with transaction.atomic(using=using):
+            if sequences.update(value=F('value') + count):
+                return sequences.values_list('value', flat=True).get() - count
+            # First order of this group: start after the highest existing order.
+            last = self.model._default_manager.using(using).filter(**group).aggregate(last=Max(self.attname))['last']
+            first = 0 if last is None else last + 1
+            try:
+                with transaction.atomic(using=using):
+                    OrderSequence.objects.using(using).create(scope=scope, value=first + count)
+                return first
+            except IntegrityError:
+                # a concurrent writer created the sequence first, reserve from it
+                sequences.update(value=F('value') + count)
+                return sequences.values_list('value', flat=True).get() - count
+
+    def advance(self, group, value):
+        """Makes sure the orders reserved next for the group come after the given one."""
+        OrderSequence = apps.get_model('courses', 'OrderSequence')
+        OrderSequence.objects.filter(scope=self.get_scope(group)).update(value=Greatest(F('value'), value + 1))
+
+    def assign(self, model_instances):
+        """Assigns orders to the instances without one, reserving them with one query per group.
+        Instances with an explicit order advance the sequence of their group once, to the highest one."""
+        groups, explicit = {}, {}
+        for instance in model_instances:
+            group = tuple(self.get_group(instance).items())
+            value = getattr(instance, self.attname)
+            if value is None:
+                groups.setdefault(group, []).append(instance)
+            else:
+                explicit[group] = max(explicit.get(group, value), value)
+                setattr(instance, self.reserved_flag, True)
+        for group, value in explicit.items():
+            self.advance(dict(group), value)
+        for group, instances in groups.items():
+            first = self.reserve(dict(group), len(instances))
+            for order, instance in enumerate(instances, start=first):
+                setattr(instance, self.attname, order)
+                setattr(instance, self.reserved_flag, True)
+
     def pre_save(self, model_instance, add):
         if getattr(model_instance, self.attname) is None:
             # no current value
-            try:
-                # using self.model to retrieve the model class the field belongs to.
-                qs = self.model.objects.all()
-                if self.for_fields:
-                    # filter by objects with the same field values for the fields in "for_fields"
-                    # same-as: you filter the QuerySet by the current value of the model fields in for_fields.
-                    query = {field: getattr(model_instance, field) for field in self.for_fields}
-                    qs = qs.filter(**query)
-                # get the order of the last item
-                last_item = qs.latest(self.attname)
-                value = last_item.order + 1
-            except ObjectDoesNotExist:
-                value = 0
+            value = self.reserve(self.get_group(model_instance))
             # assign the calculated order to the field's value in the model instance using setattr()
             setattr(model_instance, self.attname, value)
             return value
         else:
+            if add and not getattr(model_instance, self.reserved_flag, False):
+                # an explicit order on insert: the next reserved orders must come after it
+                self.advance(self.get_group(model_instance), getattr(model_instance, self.attname))
             return super().pre_save(model_instance, add)
 
 
+class OrderedQuerySet(models.QuerySet):
+    """QuerySet for models with an OrderField, bulk_create() reserves the orders of a batch at once."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for field in self.model._meta.concrete_fields:
+            if isinstance(field, OrderField):
+                field.assign(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+# OrderField doesn't guarantee that all order values are consecutive: deleted objects leave gaps.
 # More info about writing custom model fields at
 # https://docs.djangoproject.com/en/4.2/howto/custom-model-fields/
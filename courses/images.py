@@ -0,0 +1,223 @@
+"""
+Resized variants of Image contents, so students aren't sent the full-resolution upload.
+Each image stored as a blob (see storage.py) gets a THUMBNAIL_WIDTH thumbnail and a variant for each
+of VARIANT_WIDTHS narrower than itself (and one at its own width when it's narrower than the widest),
+in WebP and in a fallback format (PNG when it has transparency, JPEG otherwise). They're written once
+per source digest and width under MEDIA_ROOT/derivatives/<first two hex digits>/<digest>/<width>.<format>,
+and shared by every item referencing the same blob. Images too large for Pillow to open safely
+(DecompressionBombError) get no variants and are shown as they are.
+
+Variants are generated in a process pool once the image is saved (IMAGE_VARIANT_WORKERS processes,
+0 generates them in the calling thread). The image template lists them in a srcset served by the
+image_variant view: a variant that's still missing, e.g. after a crash or for images stored before,
+is scheduled then and the original is served meanwhile.
+"""
+import glob
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+from .storage import BLOB_DIRECTORY, blob_name, blob_storage, get_digest, is_blob
+
+THUMBNAIL_WIDTH = 160
+VARIANT_WIDTHS = (320, 640, 1280)
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG', 'png': 'PNG'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'png': 'image/png'}
+QUALITY = 80
+VARIANT_DIRECTORY = 'derivatives'
+# the width the image takes on the course pages, at most
+SIZES = f'(max-width: {VARIANT_WIDTHS[-1]}px) 100vw, {VARIANT_WIDTHS[-1]}px'
+ROTATED = (5, 6, 7, 8)  # EXIF orientations swapping width and height
+
+_executor = None
+_pending = {}  # futures of the digests being generated, so concurrent requests schedule them once
+_lock = threading.Lock()
+
+
+def is_digest(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def variant_directory(digest):
+    return blob_storage.path(f'{VARIANT_DIRECTORY}/{digest[:2]}/{digest}')
+
+
+def variant_path(digest, width, extension):
+    return os.path.join(variant_directory(digest), f'{width}.{extension}')
+
+
+def variant_url(digest, width, extension):
+    return reverse('image_variant', args=[digest, width, extension])
+
+
+def find_source(digest):
+    """Returns the name of the blob with the digest, whatever its extension, or None."""
+    paths = glob.glob(blob_storage.path(blob_name(digest, '.*')))
+    return f'{BLOB_DIRECTORY}/{digest[:2]}/{os.path.basename(paths[0])}' if paths else None
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+
+def fallback_extension(image):
+    return 'png' if has_alpha(image) else 'jpg'
+
+
+def get_widths(width):
+    """The widths of the variants of an image width pixels wide, none is wider than the image."""
+    widths = [w for w in (THUMBNAIL_WIDTH,) + VARIANT_WIDTHS if w < width]
+    if VARIANT_WIDTHS[0] < width <= VARIANT_WIDTHS[-1]:
+        widths.append(width)  # the widest candidate of the srcset, so a narrower one is never upscaled
+    return widths
+
+
+def describe(path):
+    """Returns the widths of the variants of the image at path and their fallback extension,
+    only reading its header. Animated, unreadable or oversized images have no variants."""
+    try:
+        with PILImage.open(path) as image:
+            if getattr(image, 'is_animated', False):
+                return [], None
+            width, height = image.size
+            if image.getexif().get(0x0112) in ROTATED:
+                width = height  # exif_transpose() turns it upright before resizing
+            return get_widths(width), fallback_extension(image)
+    except (OSError, UnidentifiedImageError, PILImage.DecompressionBombError):
+        return [], None
+
+
+def generate(source_path, directory):
+    """Writes the missing variants of the image at source_path into directory.
+    Runs in the pool, so it only relies on the paths it's given."""
+    try:
+        write_variants(source_path, directory)
+    except FileNotFoundError:
+        if os.path.exists(source_path):
+            raise
+    finally:
+        if not os.path.exists(source_path):
+            # the blob was released while this job was pending or running, and delete_variants()
+            # may already have run: don't leave its variants behind
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def write_variants(source_path, directory):
+    try:
+        source = PILImage.open(source_path)
+    except PILImage.DecompressionBombError:
+        return  # served as it is, see describe()
+    with source:
+        if getattr(source, 'is_animated', False):
+            return
+        os.makedirs(directory, exist_ok=True)
+        fallback = fallback_extension(source)
+        image = ImageOps.exif_transpose(source).convert('RGBA' if fallback == 'png' else 'RGB')
+        for width in get_widths(image.width):
+            extensions = [extension for extension in ('webp', fallback)
+                          if not os.path.exists(os.path.join(directory, f'{width}.{extension}'))]
+            if not extensions:
+                continue
+            height = max(1, round(image.height * width / image.width))
+            variant = image.resize((width, height), PILImage.LANCZOS)
+            for extension in extensions:
+                fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as temp_file:
+                    variant.save(temp_file, FORMATS[extension], quality=QUALITY, optimize=True)
+                if not os.path.exists(source_path):
+                    os.remove(temp_path)
+                    return
+                # readers never see a variant half written
+                os.replace(temp_path, os.path.join(directory, f'{width}.{extension}'))
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawned rather than forked: the workers don't inherit the connections and threads of the server
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                                        mp_context=get_context('spawn'))
+    return _executor
+
+
+def generate_now(*args):
+    future = Future()
+    try:
+        generate(*args)
+        future.set_result(None)
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def schedule(name):
+    """Generates the missing variants of the blob in the background, returns the Future."""
+    digest = get_digest(name)
+    args = (blob_storage.path(name), variant_directory(digest))
+    if not settings.IMAGE_VARIANT_WORKERS:
+        return generate_now(*args)
+    with _lock:
+        future = _pending.get(digest)
+        if future is not None:
+            return future
+        executor = get_executor()
+        try:
+            future = _pending[digest] = executor.submit(generate, *args)
+        except BrokenProcessPool as e:
+            # a worker died, the next call starts a new pool and this image is served as it is meanwhile
+            discard_executor(executor)
+            future = Future()
+            future.set_exception(e)
+            return future
+    # outside of the lock, the callback runs right away if it's already done
+    future.add_done_callback(lambda done: forget(digest, executor, done))
+    return future
+
+
+def discard_executor(executor):
+    # called with _lock held
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False)
+
+
+def forget(digest, executor, future):
+    with _lock:
+        if _pending.get(digest) is future:
+            del _pending[digest]
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            discard_executor(executor)
+
+
+def get_srcsets(name):
+    """Returns the srcset of the WebP variants and of the fallback ones of an Image's file,
+    or None when it's too small to have any."""
+    if not is_blob(name):
+        return None
+    widths, fallback = describe(blob_storage.path(name))
+    widths = [w for w in widths if w >= VARIANT_WIDTHS[0]]
+    if not widths:
+        return None
+    digest = get_digest(name)
+    return {
+        'webp': ', '.join(f'{variant_url(digest, w, "webp")} {w}w' for w in widths),
+        'fallback': ', '.join(f'{variant_url(digest, w, fallback)} {w}w' for w in widths),
+        'sizes': SIZES,
+    }
+
+
+def thumbnail_url(name):
+    if not is_blob(name):
+        return blob_storage.url(name)
+    return variant_url(get_digest(name), THUMBNAIL_WIDTH, 'webp')
+
+
+def delete_variants(name):
+    shutil.rmtree(variant_directory(get_digest(name)), ignore_errors=True)
@@ -0,0 +1,47 @@
+import time
+from django.conf import settings
+from django.core.cache.backends.memcached import PyMemcacheCache
+from django.core.management.base import BaseCommand
+from courses.catalog import CourseRow
+from educa.cache import TwoTierCache
+from educa.testing import MemcachedStub
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Measures the latency of cache hits on a catalog-sized value, from memcached alone '
+            'and through the in-process L1 of educa.cache.TwoTierCache')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gets', type=int, default=5000)
+        parser.add_argument('--courses', type=int, default=500, help='Rows of the cached catalog entry')
+        parser.add_argument('--stub', action='store_true',
+                            help='Use an in-process memcached stub instead of the LOCATION in settings')
+
+    def handle(self, *args, **options):
+        stub = MemcachedStub().start() if options['stub'] else None
+        location = stub.location if stub else settings.CACHES['default']['LOCATION']
+        value = [CourseRow(i, f'course-{i}', f'Course {i}', 1, 'subject', 'Subject', 'instructor', 10)
+                 for i in range(options['courses'])]
+        try:
+            for name, cache in (
+                    ('memcached (pooled)', PyMemcacheCache(location, {'OPTIONS': {'use_pooling': True}})),
+                    ('memcached + L1', TwoTierCache(location, {'OPTIONS': {'L1_KEY_PREFIXES': ['tagged:']}}))):
+                cache.set('tagged:benchmark', value)
+                assert cache.get('tagged:benchmark') == value, 'the cache server is not reachable'
+                latencies = []
+                for _ in range(options['gets']):
+                    start = time.perf_counter()
+                    cache.get('tagged:benchmark')
+                    latencies.append(time.perf_counter() - start)
+                cache.delete('tagged:benchmark')
+                self.stdout.write(f'{name:<20} p50 {percentile(latencies, 0.5) * 1e6:8.1f}us  '
+                                  f'p99 {percentile(latencies, 0.99) * 1e6:8.1f}us  '
+                                  f'{options["gets"] / sum(latencies):9.0f} gets/s')
+        finally:
+            if stub:
+                stub.stop()
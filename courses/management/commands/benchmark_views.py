@@ -0,0 +1,98 @@
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from courses import dataset
+from courses.enrollment import Enrollment
+from courses.models import Course, Module
+
+PREFIX = 'benchmark'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Measures the p50/p99 latency and queries of the catalog, course and content views '
+            'at several catalog sizes. Every catalog is generated in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000', help='Comma separated numbers of courses')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per view and size')
+        parser.add_argument('--modules', type=int, default=10, help='Modules per course')
+        parser.add_argument('--contents', type=int, default=8, help='Contents per module')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # the test client's host, and RequestMetricsMiddleware records the queries of each response
+        with override_settings(ALLOWED_HOSTS=['testserver'], METRICS_HEADERS=False):
+            for size in [int(size) for size in options['sizes'].split(',')]:
+                with transaction.atomic():
+                    dataset.generate(prefix=PREFIX, subjects=max(1, size // 20), courses=size,
+                                     modules=options['modules'], contents=options['contents'],
+                                     students=size * 2, instructors=max(1, size // 10), seed=options['seed'])
+                    cache.clear()
+                    try:
+                        for name, client, urls in self.get_targets(options):
+                            self.report(size, name, self.measure(client, urls, options))
+                    finally:
+                        transaction.set_rollback(True)
+                        # the rolled back ids are reused by the next size, entries about them must go too
+                        cache.clear()
+
+    def get_targets(self, options):
+        """Returns (view name, client, urls) for every view, the urls are cycled through."""
+        rng = random.Random(options['seed'])
+        courses = list(Course.objects.filter(slug__startswith=PREFIX).values_list('id', 'slug'))
+        sample = rng.sample(courses, min(len(courses), options['requests']))
+        anonymous = Client()
+
+        student = User.objects.get(username=f'{PREFIX}-student-0')
+        enrolled = list(Enrollment.objects.filter(user=student).values_list('course_id', flat=True))
+        student_client = Client()
+        student_client.force_login(student)
+        token = Token.objects.create(user=student)
+        api_client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        instructor = User.objects.get(username=f'{PREFIX}-instructor-0')
+        modules = list(Module.objects.filter(course__owner=instructor).values_list('id', flat=True)
+                       [:options['requests']])
+        instructor_client = Client()
+        instructor_client.force_login(instructor)
+        return [
+            ('course_list', anonymous, [reverse('course_list')]),
+            ('course_detail', anonymous, [reverse('course_detail', args=[slug]) for id, slug in sample]),
+            ('student_course_detail', student_client,
+             [reverse('student_course_detail', args=[id]) for id in enrolled]),
+            ('module_content_list', instructor_client,
+             [reverse('module_content_list', args=[id]) for id in modules]),
+            ('course-contents', api_client, [reverse('course-contents', args=[id]) for id in enrolled]),
+        ]
+
+    def measure(self, client, urls, options):
+        latencies, queries = [], []
+        for i in range(options['requests']):
+            if options['cold']:
+                cache.clear()
+            start = time.perf_counter()
+            response = client.get(urls[i % len(urls)])
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            queries.append(response.metrics.queries)
+        return latencies, queries
+
+    def report(self, size, name, measurements):
+        latencies, queries = measurements
+        self.stdout.write(f'{size:>6} courses  {name:<22} '
+                          f'p50 {percentile(latencies, 0.5) * 1000:7.2f}ms  '
+                          f'p99 {percentile(latencies, 0.99) * 1000:7.2f}ms  '
+                          f'queries p50 {percentile(queries, 0.5)} max {max(queries)}')
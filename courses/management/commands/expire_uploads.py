@@ -0,0 +1,15 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from courses.api import uploads
+
+
+class Command(BaseCommand):
+    help = 'Discards the chunked uploads that were not completed in time, with their temporary files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=uploads.UPLOAD_TTL.total_seconds() / 3600,
+                            help='Age after which an incomplete upload is discarded')
+
+    def handle(self, *args, **options):
+        count = uploads.expire(timedelta(hours=options['hours']))
+        self.stdout.write(f'{count} uploads expired')
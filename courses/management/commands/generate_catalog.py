@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from courses import dataset
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic catalog of subjects, courses, modules, contents and enrolled students'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='catalog', help='Prefix of the generated slugs and usernames')
+        parser.add_argument('--subjects', type=int, default=5)
+        parser.add_argument('--courses', type=int, default=50)
+        parser.add_argument('--modules', type=int, default=10, help='Modules per course')
+        parser.add_argument('--contents', type=int, default=8, help='Text/Video/Image/File contents per module')
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--enrollments', type=int, default=3, help='Courses joined by each student')
+        parser.add_argument('--instructors', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        created = dataset.generate(**{name: options[name] for name in (
+            'prefix', 'subjects', 'courses', 'modules', 'contents', 'students', 'enrollments', 'instructors', 'seed')})
+        self.stdout.write(', '.join(f'{count} {name}' for name, count in created.items()))
+        self.stdout.write(f'Users log in with the password "{dataset.PASSWORD}", '
+                          f'run rebuild_search_index to make the catalog searchable')
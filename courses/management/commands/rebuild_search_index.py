@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from courses import search
+
+
+class Command(BaseCommand):
+    help = 'Indexes every course, module and text content for the full-text search from scratch'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write('The full-text index needs SQLite FTS5, search uses icontains lookups instead')
+            return
+        search.rebuild()
+        self.stdout.write('Search index rebuilt')
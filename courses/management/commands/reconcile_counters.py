@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from courses import counters
+
+
+class Command(BaseCommand):
+    help = 'Repairs the course, module and student counters that drifted from the actual counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the rows whose counters drifted')
+
+    def handle(self, *args, **options):
+        for field in counters.COUNTERS:
+            if options['dry_run']:
+                count = len(counters.find_drift(field))
+            else:
+                count = counters.reconcile_field(field)
+            self.stdout.write(f'{field}: {count} drifted')
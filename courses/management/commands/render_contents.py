@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from courses.models import Text, Video, Image, File
+
+
+class Command(BaseCommand):
+    help = 'Re-renders and stores the HTML of every content item (text, video, image and file)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true',
+                            help='Only render items stored with an older RENDER_VERSION')
+
+    def handle(self, *args, **options):
+        for model in (Text, Video, Image, File):
+            items = model.objects.all()
+            if options['stale']:
+                items = items.exclude(rendered_version=model.RENDER_VERSION)
+            count = 0
+            for item in items.iterator():
+                item.store_rendered()
+                count += 1
+            self.stdout.write(f'Rendered {count} {model._meta.verbose_name_plural}')
@@ -0,0 +1,21 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_item_rendered'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=250, unique=True)),
+                ('value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_ordersequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-created', '-id'], name='courses_cou_created_6b44b3_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from courses.search import has_fts5
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is an SQLite extension, other backends search with icontains lookups (see courses/search.py)
+    if has_fts5(schema_editor.connection):
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE courses_search USING fts5("
+            "kind UNINDEXED, object_id UNINDEXED, course_id UNINDEXED, title, body, "
+            "tokenize = 'porter unicode61')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if has_fts5(schema_editor.connection):
+        schema_editor.execute('DROP TABLE courses_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_course_created_index'),
+    ]
+
+    operations = [
+        # fill it with: python manage.py rebuild_search_index
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-18 20:21
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing(apps, schema_editor):
+    Subject = apps.get_model('courses', 'Subject')
+    Course = apps.get_model('courses', 'Course')
+    Module = apps.get_model('courses', 'Module')
+
+    def count(model, foreign_key):
+        return Coalesce(Subquery(model.objects.filter(**{foreign_key: OuterRef('pk')}).order_by()
+                                 .values(foreign_key).annotate(total=Count('*')).values('total')), 0)
+
+    Subject.objects.update(total_courses=count(Course, 'subject'))
+    Course.objects.update(total_modules=count(Module, 'course'),
+                          total_students=count(Course.students.through, 'course'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='total_modules',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='total_students',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='total_courses',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing, migrations.RunPython.noop),
+    ]
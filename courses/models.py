@@ -1,14 +1,45 @@
-from django.db import models
+import uuid
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
-from .fields import OrderField
+from .fields import OrderField, OrderedQuerySet
+from .storage import blob_storage, blob_lock
+from . import images
 from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 
-class Subject(models.Model):
+class OrderSequence(models.Model):
+    """Next free order of each group of objects with an OrderField, e.g. of the modules of a course."""
+    scope = models.CharField(max_length=250, unique=True)
+    value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.scope}: {self.value}'
+
+
+class CountersMixin(object):
+    """
+    Counter fields are only changed by atomic F() updates (see counters.py), so saving an instance
+    loaded earlier must not write back the counter values it was loaded with.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
+
+class Subject(CountersMixin, models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
+    total_courses = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_courses',)
 
     class Meta:
         ordering = ['title']
@@ -17,7 +48,7 @@ class Subject(models.Model):
         return self.title
 
 
-class Course(models.Model):
+class Course(CountersMixin, models.Model):
     owner = models.ForeignKey(User, related_name='courses_created', on_delete=models.CASCADE)
     subject = models.ForeignKey(Subject, related_name='courses', on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -26,9 +57,15 @@ class Course(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     # To associate students with courses they've enrolled for
     students = models.ManyToManyField(User, related_name='courses_joined', blank=True)
+    total_modules = models.PositiveIntegerField(default=0, editable=False)
+    total_students = models.PositiveIntegerField(default=0, editable=False)
+
+    counter_fields = ('total_modules', 'total_students')
 
     class Meta:
         ordering = ['-created']
+        # the courses API pages through the catalog by (created, id)
+        indexes = [models.Index(fields=['-created', '-id'])]
 
     def __str__(self):
         return self.title
@@ -42,6 +79,8 @@ class Module(models.Model):
     # This means that the order for a new module will be assigned by adding 1 to the
     # last module of the same 'Course' object
 
+    objects = OrderedQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.order}. {self.title}'
 
@@ -49,6 +88,13 @@ class Module(models.Model):
         ordering = ['order']
 
 
+class ContentQuerySet(OrderedQuerySet):
+    def with_items(self):
+        """Resolve the generic 'item' of every content in one query per content type
+        (text, video, image, file) instead of one query per content row."""
+        return self.select_related('content_type').prefetch_related('item')
+
+
 class Content(models.Model):
     """using generic relations to create foreign keys that can point to the objects of any model"""
     module = models.ForeignKey(Module, related_name='contents', on_delete=models.CASCADE)
@@ -59,6 +105,8 @@ class Content(models.Model):
     item = GenericForeignKey('content_type', 'object_id')  # to retrieve or set the related object directly
     order = OrderField(blank=True, for_fields=['module'])  # the order is calculated with respect to the module field.
 
+    objects = ContentQuerySet.as_manager()
+
     class Meta:
         ordering = ['order']
 
@@ -72,13 +120,27 @@ class ItemBase(models.Model):
     # Therefore, related_name for each child model will be generated automatically
     # the reverse relationship for child models will be text_related, file_related,....
 
+    # The rendered HTML is stored when the item is saved, so reading an item doesn't render its template.
+    # Bump RENDER_VERSION whenever the courses/content/ templates change, stale items are re-rendered
+    # on their next read or by the render_contents management command.
+    RENDER_VERSION = 2
+    rendered = models.TextField(blank=True, editable=False)
+    rendered_version = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         abstract = True
 
     def __str__(self):
         return self.title
 
-    def render(self):
+    def save(self, *args, **kwargs):
+        # one transaction, the caches of the item are invalidated once it commits (see signals.py)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # rendered after saving, so that uploaded files already have their final URL
+            self.store_rendered()
+
+    def render_template(self):
         """Uses render_to_string to return a template and return the rendered content as a string"""
         return render_to_string(
             # Each type of content is rendered using a template named after their content model
@@ -86,25 +148,117 @@ class ItemBase(models.Model):
             {'item': self}
         )
 
+    def store_rendered(self):
+        self.rendered = self.render_template()
+        self.rendered_version = self.RENDER_VERSION
+        # update() doesn't send the post_save signal or touch the 'updated' field
+        type(self).objects.filter(pk=self.pk).update(rendered=self.rendered,
+                                                     rendered_version=self.rendered_version)
+
+    def render(self):
+        """Returns the stored HTML of the item, re-rendering it if its templates changed since."""
+        if self.rendered_version != self.RENDER_VERSION:
+            self.store_rendered()
+        return mark_safe(self.rendered)
+
+
+class BlobManager(models.Manager):
+    def acquire(self, name, content=None):
+        """Adds a reference to the blob stored under name. content, the uploaded file, stores the blob
+        again if a release of the same bytes deleted it since the upload found it in place."""
+        with transaction.atomic():
+            blob, created = self.get_or_create(name=name, defaults={'size': 0})
+            self.filter(pk=blob.pk).update(references=F('references') + 1)
+            # from here on the file can't be deleted: delete_unreferenced() waits for this transaction
+            # and then sees the reference. It may have deleted it just before though.
+            if not blob_storage.exists(name):
+                if content is None:
+                    raise FileNotFoundError(f'The blob {name} was deleted while it was referenced again')
+                blob_storage.save(name, content)  # under blob_lock(), like any upload
+            if created:
+                self.filter(pk=blob.pk).update(size=blob_storage.size(name))
+
+    def release(self, name):
+        """Removes a reference to the blob, deleting it with its last one."""
+        with transaction.atomic():
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.references > 1:
+                self.filter(pk=blob.pk).update(references=F('references') - 1)
+            else:
+                blob.delete()
+                # the file goes once the row is gone for good, a rollback keeps both
+                transaction.on_commit(lambda: self.delete_unreferenced(name))
+
+    def delete_unreferenced(self, name):
+        with transaction.atomic():
+            # inserting the name waits for a transaction that referenced the blob again and hasn't
+            # committed yet, then finds its row
+            blob, created = self.get_or_create(name=name, defaults={'size': 0})
+            if blob.references:
+                return
+            blob.delete()
+            with blob_lock():
+                blob_storage.delete(name)
+                images.delete_variants(name)
+
+
+class Blob(models.Model):
+    """A file stored once by ContentAddressedStorage, with the number of items referencing it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
 
 class Text(ItemBase):
     content = models.TextField()
 
 
 class File(ItemBase):
-    file = models.FileField(upload_to='files')
+    file = models.FileField(upload_to='files', storage=blob_storage)
 
 
 class Image(ItemBase):
-    file = models.FileField(upload_to='images')
+    file = models.FileField(upload_to='images', storage=blob_storage)
+
+    def srcsets(self):
+        """The srcset and sizes of its resized variants, see images.py"""
+        return images.get_srcsets(self.file.name)
+
+    def thumbnail_url(self):
+        return images.thumbnail_url(self.file.name)
 
 
 class Video(ItemBase):
     url = models.URLField()
 
 
+class Upload(models.Model):
+    """A File or Image upload sent in chunks (see api/uploads.py), until it's complete."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='uploads', on_delete=models.CASCADE)
+    module = models.ForeignKey(Module, related_name='uploads', on_delete=models.CASCADE)
+    model_name = models.CharField(max_length=10, choices=[('file', 'File'), ('image', 'Image')])
+    title = models.CharField(max_length=250)
+    filename = models.CharField(max_length=250)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256 of the whole file, hex
+    chunk_size = models.PositiveIntegerField()
+    received = models.PositiveBigIntegerField(default=0)  # bytes written, the offset of the next chunk
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+
+
 # OrderField field does not guarantee that all order values are consecutive.
-# However, it respects existing order values and always assigns the next order based on the highest existing order.
+# The first order of a group is assigned after its highest existing order, the next ones come from its OrderSequence.
 # To calculate the new module's order, the field only considers existing modules that belong to the same course.
 
 
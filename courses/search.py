@@ -0,0 +1,111 @@
+"""
+Full-text search over courses, modules and text contents.
+Documents are stored in an SQLite FTS5 table (created by migration 0008), an on-disk inverted index
+that is updated incrementally by the receivers in signals.py and ranked with bm25.
+On other database backends, and on SQLite libraries built without FTS5, search falls back to icontains
+lookups on the course title and overview.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from .models import Course, Module, Content, Text
+
+INDEX_TABLE = 'courses_search'
+TITLE_WEIGHT = 10.0  # a match in a title ranks higher than one in a body
+SEARCH_LIMIT = 50
+
+_has_fts5 = {}  # by database alias, the compile options don't change while the process runs
+
+
+def has_fts5(connection):
+    """Whether the database of the connection is an SQLite built with FTS5, probed once."""
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias not in _has_fts5:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            _has_fts5[connection.alias] = ('ENABLE_FTS5',) in cursor.fetchall()
+    return _has_fts5[connection.alias]
+
+
+def is_available():
+    return has_fts5(connection)
+
+
+def remove_documents(kind, object_id):
+    if is_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE kind = %s AND object_id = %s', [kind, object_id])
+
+
+def index_documents(kind, object_id, documents):
+    """Replaces the documents of an object with the given (course_id, title, body) documents."""
+    if not is_available():
+        return
+    remove_documents(kind, object_id)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {INDEX_TABLE} (kind, object_id, course_id, title, body) '
+                           f'VALUES (%s, %s, %s, %s, %s)',
+                           [(kind, object_id, course_id, title, body) for course_id, title, body in documents])
+
+
+def index_course(course):
+    index_documents('course', course.id, [(course.id, course.title, course.overview)])
+
+
+def index_module(module):
+    index_documents('module', module.id, [(module.course_id, module.title, module.description)])
+
+
+def index_text(text):
+    # a text is found through the courses whose modules contain it
+    course_ids = Content.objects.filter(content_type__model='text', object_id=text.id)\
+        .values_list('module__course_id', flat=True).distinct()
+    index_documents('text', text.id, [(course_id, text.title, text.content) for course_id in course_ids])
+
+
+def rebuild():
+    """Indexes every course, module and text from scratch."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+    for course in Course.objects.iterator():
+        index_course(course)
+    for module in Module.objects.iterator():
+        index_module(module)
+    for text in Text.objects.iterator():
+        index_text(text)
+
+
+def make_query(query):
+    # every word must match, as a prefix, quoted so that user input is never parsed as FTS5 syntax
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+
+
+def search_courses(query, limit=SEARCH_LIMIT, subject_id=None):
+    """Returns the ids of the courses matching the query, best match first,
+    only among the courses of subject_id if given."""
+    match = make_query(query)
+    if not match:
+        return []
+    if not is_available():
+        courses = Course.objects.filter(Q(title__icontains=query) | Q(overview__icontains=query))
+        if subject_id is not None:
+            courses = courses.filter(subject_id=subject_id)
+        return list(courses.values_list('id', flat=True)[:limit])
+    params = [TITLE_WEIGHT, match]
+    subject_filter = ''
+    if subject_id is not None:
+        # restricted before the limit, so better matches in other subjects don't crowd out this one's
+        subject_filter = f'AND course_id IN (SELECT id FROM {Course._meta.db_table} WHERE subject_id = %s) '
+        params.append(subject_id)
+    with connection.cursor() as cursor:
+        # bm25() is lower for better matches, a course ranks by its best matching document.
+        # The matches are materialized, bm25() can't be evaluated inside the GROUP BY.
+        cursor.execute(f'WITH matches AS MATERIALIZED ('
+                       f'SELECT course_id, bm25({INDEX_TABLE}, 0, 0, 0, %s, 1.0) AS score '
+                       f'FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s {subject_filter}) '
+                       f'SELECT course_id, MIN(score) AS best FROM matches '
+                       f'GROUP BY course_id ORDER BY best LIMIT %s', params + [limit])
+        return [int(course_id) for course_id, best in cursor.fetchall()]
@@ -0,0 +1,254 @@
+"""
+Bump the cache tags (see cache_tags.py) of everything a changed object is displayed in.
+A change propagates upwards: content -> module -> course -> subject.
+"""
+import os
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .models import Subject, Course, Module, Content, Text, Video, Image, File, Blob
+from . import cache_tags, counters, enrollment, images, search
+from .cache_tags import tag_for
+from .catalog import CATALOG_TAG
+from .api.authentication import token_cache
+from .autocomplete import autocomplete
+from .storage import is_blob, get_digest
+
+
+@receiver([post_save, post_delete], sender=Subject)
+def invalidate_subject(sender, instance, **kwargs):
+    cache_tags.invalidate(tag_for(Subject, instance.pk), CATALOG_TAG)
+
+
+@receiver([post_save, post_delete], sender=Course)
+def invalidate_course(sender, instance, **kwargs):
+    cache_tags.invalidate(tag_for(Course, instance.pk),
+                          tag_for(Subject, instance.subject_id),
+                          CATALOG_TAG)
+
+
+@receiver([post_save, post_delete], sender=Module)
+def invalidate_module(sender, instance, **kwargs):
+    cache_tags.invalidate(tag_for(Module, instance.pk),
+                          tag_for(Course, instance.course_id),
+                          CATALOG_TAG)  # the catalog displays the number of modules of each course
+
+
+@receiver([post_save, post_delete], sender=Content)
+def invalidate_content(sender, instance, **kwargs):
+    course_id = Module.objects.filter(id=instance.module_id).values_list('course_id', flat=True).first()
+    cache_tags.invalidate(tag_for(Content, instance.pk),
+                          tag_for(Module, instance.module_id),
+                          tag_for(Course, course_id))
+
+
+@receiver(post_save, sender=Text)
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=File)
+def invalidate_item(sender, instance, created, **kwargs):
+    """An edited item changes the rendered contents of the modules it belongs to. Invalidated on commit:
+    ItemBase.save() stores the rendered HTML after this signal, a read in between would cache the old one."""
+    if created:
+        return  # not attached to any module yet
+    contents = Content.objects.filter(content_type=ContentType.objects.get_for_model(sender),
+                                      object_id=instance.pk).values_list('id', 'module_id',
+                                                                         'module__course_id')
+    tags = []
+    for content_id, module_id, course_id in contents:
+        tags += [tag_for(Content, content_id), tag_for(Module, module_id), tag_for(Course, course_id)]
+    transaction.on_commit(lambda: cache_tags.invalidate(*tags))
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def invalidate_course_students(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # changed from the user's side: user.courses_joined.add(...)
+        course_ids = pk_set or []
+    else:
+        course_ids = [instance.pk]
+    cache_tags.invalidate(*[tag_for(Course, course_id) for course_id in course_ids])
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def update_enrollments(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # changed from the user's side: user.courses_joined.add(...)
+        if action == 'pre_clear':
+            instance._cleared_enrollments = enrollment.get_user_courses(instance)
+        elif action in ('post_add', 'post_remove', 'post_clear'):
+            course_ids = getattr(instance, '_cleared_enrollments', ()) if action == 'post_clear' else pk_set
+            enrollment.forget(course_ids=course_ids, user_ids=[instance.pk])
+    else:
+        # changed from the course's side: course.students.add(...)
+        if action == 'pre_clear':
+            instance._cleared_enrollments = enrollment.get_course_students(instance.pk)
+        elif action in ('post_add', 'post_remove', 'post_clear'):
+            user_ids = getattr(instance, '_cleared_enrollments', ()) if action == 'post_clear' else pk_set
+            enrollment.forget(course_ids=[instance.pk], user_ids=user_ids)
+
+
+@receiver(post_init, sender=Course)
+@receiver(post_init, sender=Module)
+def remember_counted_parent(sender, instance, **kwargs):
+    # the parent the instance is counted in, to move the count if the instance is moved to another one
+    attname = counters.PARENTS[sender][0]
+    instance._counted_parent_id = instance.__dict__.get(attname)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Module)
+def count_in_parent(sender, instance, created, **kwargs):
+    attname, field = counters.PARENTS[sender]
+    parent_id = getattr(instance, attname)
+    if created:
+        counters.adjust(field, [parent_id], 1)
+    elif instance._counted_parent_id not in (None, parent_id):
+        counters.adjust(field, [instance._counted_parent_id], -1)
+        counters.adjust(field, [parent_id], 1)
+    instance._counted_parent_id = parent_id
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+def uncount_in_parent(sender, instance, **kwargs):
+    attname, field = counters.PARENTS[sender]
+    counters.adjust(field, [getattr(instance, attname)], -1)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def count_students(sender, instance, action, reverse, pk_set, **kwargs):
+    # registered after update_enrollments, which remembers the enrollments removed by a clear()
+    if action == 'post_add':
+        # pk_set only holds the new enrollments
+        if reverse:
+            counters.adjust('total_students', pk_set, 1)
+        else:
+            counters.adjust('total_students', [instance.pk], len(pk_set))
+    elif action in ('post_remove', 'post_clear'):
+        # remove() reports every given pk, enrolled or not: count the remaining students instead
+        if reverse:
+            course_ids = instance._cleared_enrollments if action == 'post_clear' else pk_set
+        else:
+            course_ids = [instance.pk]
+        counters.recount('total_students', course_ids)
+
+
+@receiver(pre_delete, sender=User)
+def remember_joined_courses(sender, instance, **kwargs):
+    # the enrollments of a deleted user are removed by the cascade, without m2m_changed
+    instance._joined_courses = enrollment.get_user_courses(instance)
+
+
+@receiver(post_delete, sender=User)
+def uncount_student(sender, instance, **kwargs):
+    joined_courses = getattr(instance, '_joined_courses', ())
+    counters.adjust('total_students', joined_courses, -1)
+    # the cascade didn't send m2m_changed either: the courses' entries still list the user
+    enrollment.forget(course_ids=joined_courses, user_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def forget_course(sender, instance, **kwargs):
+    # the users' entries only keep the id of the deleted course, which no longer matches any course
+    enrollment.forget(course_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def revoke_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    search.index_course(instance)
+
+
+@receiver(post_save, sender=Module)
+def index_module(sender, instance, **kwargs):
+    search.index_module(instance)
+
+
+@receiver(post_save, sender=Text)
+def index_text(sender, instance, **kwargs):
+    search.index_text(instance)
+
+
+@receiver([post_save, post_delete], sender=Content)
+def index_content_text(sender, instance, **kwargs):
+    # adding or removing a text to a module changes the courses it's found through
+    if instance.content_type.model == 'text':
+        text = Text.objects.filter(id=instance.object_id).first()
+        if text is None:
+            search.remove_documents('text', instance.object_id)
+        else:
+            search.index_text(text)
+
+
+@receiver(post_delete, sender=Course)
+@receiver(post_delete, sender=Module)
+@receiver(post_delete, sender=Text)
+def remove_from_search(sender, instance, **kwargs):
+    search.remove_documents(sender._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Course)
+def update_autocomplete(sender, instance, **kwargs):
+    # a rolled back change never reaches the index of the process
+    transaction.on_commit(lambda: autocomplete.update(instance))
+
+
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Course)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind, id = sender._meta.model_name, instance.pk  # the pk is cleared once the deletion is done
+    transaction.on_commit(lambda: autocomplete.remove(kind, id))
+
+
+@receiver(post_init, sender=File)
+@receiver(post_init, sender=Image)
+def remember_blob(sender, instance, **kwargs):
+    # the name of the blob the item references in the database, if loaded
+    instance._referenced_blob = instance.__dict__.get('file') or ''
+    if not isinstance(instance._referenced_blob, str):
+        instance._referenced_blob = ''  # a new file, referenced once saved
+
+
+@receiver(pre_save, sender=File)
+@receiver(pre_save, sender=Image)
+def remember_uploaded_file(sender, instance, **kwargs):
+    # the field only keeps the stored name once saved, Blob.objects.acquire() may need the content
+    instance._uploaded_file = None if instance.file._committed else instance.file.file
+
+
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Image)
+def reference_blob(sender, instance, **kwargs):
+    name = instance.file.name or ''
+    if name != instance._referenced_blob:
+        if is_blob(name):
+            Blob.objects.acquire(name, getattr(instance, '_uploaded_file', None))
+        if is_blob(instance._referenced_blob):
+            Blob.objects.release(instance._referenced_blob)  # the file was replaced
+        instance._referenced_blob = name
+
+
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=Image)
+def release_blob(sender, instance, **kwargs):
+    if is_blob(instance.file.name):
+        Blob.objects.release(instance.file.name)
+
+
+@receiver(post_save, sender=Image)
+def generate_image_variants(sender, instance, **kwargs):
+    name = instance.file.name
+    if is_blob(name) and not os.path.isdir(images.variant_directory(get_digest(name))):
+        # once the blob is committed, so a rollback doesn't leave variants behind
+        transaction.on_commit(lambda: images.schedule(name))
@@ -0,0 +1,97 @@
+"""
+Cache stampede protection: get_or_compute() recomputes an expired or missing entry once,
+however many requests (in any process) ask for it at the same time.
+- Entries are stored for STALE_TIMEOUT longer than they're fresh. A stale entry is still served
+  while a single request, holding a lock in the cache, recomputes it (stale-while-revalidate).
+- A fresh entry is recomputed early with a probability that rises as it gets closer to expiring
+  and with the time its computation took (XFetch), so popular entries are usually refreshed before
+  they go stale at all.
+- When there's nothing to serve, the requests that don't get the lock wait for the one that does.
+"""
+import math
+import random
+import time
+from collections import namedtuple
+from django.core.cache import cache
+
+STALE_TIMEOUT = 60  # how long an expired entry can still be served while it's recomputed
+LOCK_TIMEOUT = 10  # a computation taking longer than this lets another request start one
+WAIT_INTERVAL = 0.05
+BETA = 1.0  # > 1 favours earlier refreshes
+
+Entry = namedtuple('Entry', ['value', 'expires', 'compute_time'])
+
+
+def lock_key(key):
+    # not under the key's own prefix, the lock is never kept in an in-process cache
+    return f'lock:{key}'
+
+
+def get_shared(key):
+    # what the other processes stored, rather than this process's in-memory copy (see educa/cache.py)
+    get = getattr(cache, 'get_shared', cache.get)
+    return get(key)
+
+
+def make_entry(value, timeout, compute_time):
+    expires = None if timeout is None else time.time() + timeout
+    return Entry(value, expires, compute_time)
+
+
+def backend_timeout(timeout):
+    return None if timeout is None else timeout + STALE_TIMEOUT
+
+
+def set_value(key, value, timeout, compute_time=0.0):
+    cache.set(key, make_entry(value, timeout, compute_time), backend_timeout(timeout))
+
+
+def set_many(values, timeout, compute_time=0.0):
+    """Stores entries computed together with another one, e.g. the other entries of the catalog."""
+    cache.set_many({key: make_entry(value, timeout, compute_time) for key, value in values.items()},
+                   backend_timeout(timeout))
+
+
+def needs_refresh(entry):
+    if entry.expires is None:
+        return False
+    # -log(random()) is exponentially distributed: the refresh happens early now and then,
+    # and all the more often as the expiry gets closer than the time a computation takes
+    return time.time() - entry.compute_time * BETA * math.log(random.random() or 1e-12) >= entry.expires
+
+
+def compute_and_set(key, compute, timeout):
+    start = time.perf_counter()
+    value = compute()
+    set_value(key, value, timeout, time.perf_counter() - start)
+    return value
+
+
+def get_or_compute(key, compute, timeout):
+    """Returns the cached value of key, calling compute() to store a new one when it's missing,
+    expired or elected for an early refresh, in a single caller at a time."""
+    entry = cache.get(key)
+    if entry is not None and not needs_refresh(entry):
+        return entry.value
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        if cache.add(lock_key(key), 1, LOCK_TIMEOUT):
+            try:
+                current = get_shared(key)
+                if current is not None and (entry is None or current.expires != entry.expires):
+                    return current.value  # stored by the previous lock holder meanwhile
+                return compute_and_set(key, compute, timeout)
+            finally:
+                cache.delete(lock_key(key))
+        if entry is not None:
+            return entry.value  # another request is refreshing it, serve the current value meanwhile
+        if cache.get(lock_key(key)) is None:
+            # the holder just released it, or the cache server can't be reached and nothing is stored
+            entry = get_shared(key)
+            return compute_and_set(key, compute, timeout) if entry is None else entry.value
+        if time.monotonic() >= deadline:
+            return compute()  # the lock holder is stuck, don't keep the request waiting any longer
+        time.sleep(WAIT_INTERVAL)
+        entry = get_shared(key)
+        if entry is not None:
+            return entry.value
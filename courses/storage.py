@@ -0,0 +1,87 @@
+"""
+Content-addressed storage for the files of File and Image items.
+An upload is hashed (SHA-256) while it's copied to a temporary file, then stored once as
+blobs/<first two hex digits>/<digest><extension>: uploading the same bytes again, to any course,
+reuses the stored blob. The Blob model counts the items referencing each blob (see signals.py),
+the blob is deleted with its last reference.
+Files stored before (under files/ and images/) keep their names and are not reference counted.
+Storing a blob and deleting an unreferenced one hold blob_lock(). A release deletes the file only if
+no reference was taken meanwhile, and a reference taken right after a release deleted the file that
+the upload found in place stores it again (see BlobManager).
+"""
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIRECTORY = 'blobs'
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIRECTORY}/{digest[:2]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(f'{BLOB_DIRECTORY}/')
+
+
+@contextmanager
+def blob_lock(storage=None):
+    """Exclusive lock over the blobs of the storage, across threads and processes."""
+    directory = (storage or blob_storage).path(BLOB_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'wb') as lock_file:
+        locks.lock(lock_file, locks.LOCK_EX)
+        try:
+            yield
+        finally:
+            locks.unlock(lock_file)
+
+
+def get_digest(name):
+    """Returns the digest of a blob from its name."""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # the final name only depends on the content, see _save()
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        directory = self.path(BLOB_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        # written next to the blobs, so that moving it in place is a rename on the same filesystem
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            name = blob_name(digest.hexdigest(), extension)
+            path = self.path(name)
+            with blob_lock(self):
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # atomic: a blob is never seen half written, and concurrent uploads of the
+                    # same bytes just replace it with an identical file
+                    os.replace(temp_path, path)
+                    temp_path = None
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+            return name
+        finally:
+            if temp_path is not None:
+                os.remove(temp_path)
+
+
+blob_storage = ContentAddressedStorage()
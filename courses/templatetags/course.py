@@ -1,4 +1,6 @@
 from django import template
+from django.core.cache.utils import make_template_fragment_key
+from .. import cache_tags
 
 register = template.Library()
 
@@ -12,3 +14,35 @@ def model_name(obj):
     except AttributeError:
         return None
 
+
+class TaggedCacheNode(template.Node):
+    def __init__(self, nodelist, expire_time, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.expire_time = expire_time
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        expire_time = self.expire_time.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        # model instances the fragment varies on are also the tags it depends on
+        tags = [cache_tags.tag_for_object(obj) for obj in vary_on if hasattr(obj, '_meta')]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return cache_tags.get_or_compute_entry(key, tags, lambda: self.nodelist.render(context), expire_time)
+
+
+@register.tag('tagged_cache')
+def do_tagged_cache(parser, token):
+    """Like {% cache %}, but the fragment goes stale as soon as one of the objects it varies on changes.
+
+        {% tagged_cache 21600 module_contents module %}
+            ...
+        {% endtagged_cache %}
+    """
+    nodelist = parser.parse(('endtagged_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least 2 arguments.")
+    return TaggedCacheNode(nodelist, parser.compile_filter(bits[1]), bits[2],
+                           [parser.compile_filter(bit) for bit in bits[3:]])
@@ -1,3 +1,1214 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.contrib.auth.models import User, Permission
+from django.urls import reverse
+from django.core.management import call_command
+from rest_framework.authtoken.models import Token
+from io import StringIO
+from datetime import timedelta
+from django.utils import timezone
+import json
+import threading
+import time
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image as PILImage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest.mock import patch, Mock
+from concurrent.futures.process import BrokenProcessPool
+from .models import Subject, Course, Module, Content, Text, Video, Image, File, Blob, Upload
+from .storage import blob_storage, BLOB_DIRECTORY
+from . import catalog, cache_tags, counters, dataset, enrollment, images, search, stampede
+from .api.contents import build_course_contents
+from .api.authentication import token_cache
+from .api.selection import FieldSelection
+from .api import uploads
+from .autocomplete import autocomplete, PrefixIndex, TOP_K
+from educa.metrics import view_stats, instrument_cache, current_metrics, RequestMetrics
+from django.core.cache import caches
+from educa.testing import QueryBudgetMixin, MemcachedStub
+from educa.cache import TwoTierCache
+from django.core.cache.backends.memcached import PyMemcacheCache
+from memcache_status.utils import get_cache_stats
 
-# Create your tests here.
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class CourseDataMixin(object):
+    """Builds a subject, a course owned by an instructor and a single module."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('instructor', password='secret')
+        self.student = User.objects.create_user('student', password='secret')
+        self.subject = Subject.objects.create(title='Programming', slug='programming')
+        self.course = Course.objects.create(owner=self.owner, subject=self.subject,
+                                            title='Django', slug='django', overview='Web')
+        self.module = Module.objects.create(course=self.course, title='Intro')
+
+    def add_contents(self, count):
+        for i in range(count):
+            if i % 2:
+                item = Video.objects.create(owner=self.owner, title=f'video {i}',
+                                            url='https://www.youtube.com/watch?v=abc')
+            else:
+                item = Text.objects.create(owner=self.owner, title=f'text {i}', content='Hello')
+            Content.objects.create(module=self.module, item=item)
+
+    def add_every_item_type(self):
+        """Adds one content of each type (text, video, image and file) to the module."""
+        self.add_contents(2)
+        for model in (Image, File):
+            item = model.objects.create(owner=self.owner, title=f'{model.__name__}', file='files/x.png')
+            Content.objects.create(module=self.module, item=item)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+
+class ContentItemLoadingTests(CourseDataMixin, TestCase):
+    def test_with_items_resolves_every_item(self):
+        self.add_contents(4)
+        contents = list(self.module.contents.with_items())
+        with self.assertNumQueries(0):
+            titles = [content.item.title for content in contents]
+        self.assertEqual(titles, ['text 0', 'video 1', 'text 2', 'video 3'])
+
+    def test_module_content_list_query_count_is_fixed(self):
+        self.client.login(username='instructor', password='secret')
+        url = reverse('module_content_list', args=[self.module.id])
+        self.add_contents(2)
+        few = self.count_queries(url)
+        self.add_contents(20)
+        self.assertEqual(self.count_queries(url), few)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogSnapshotTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+
+    def test_snapshot_is_built_once(self):
+        with self.assertNumQueries(2):
+            courses = catalog.get_courses()
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get_courses(self.subject.id), courses)
+            subjects = catalog.get_subjects()
+        self.assertEqual(courses[0].total_modules, 1)
+        self.assertEqual(subjects[0].total_courses, 1)
+
+    def test_snapshot_is_rebuilt_on_change(self):
+        catalog.get_courses()
+        Module.objects.create(course=self.course, title='Models')
+        self.assertEqual(catalog.get_courses()[0].total_modules, 2)
+        self.course.title = 'Django 4'
+        self.course.save()
+        self.assertEqual(catalog.get_courses(self.subject.id)[0].title, 'Django 4')
+
+    def test_course_list_view(self):
+        response = self.client.get(reverse('course_list_subject', args=['programming']))
+        self.assertContains(response, 'Django')
+        response = self.client.get(reverse('course_list_subject', args=['unknown']))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CacheTagTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+
+    def test_entry_goes_stale_when_tag_is_bumped(self):
+        cache_tags.set_entry('key', 'value', ['course:1', 'module:2'])
+        self.assertEqual(cache_tags.get_entry('key', ['module:2', 'course:1']), 'value')
+        cache_tags.invalidate('module:2')
+        self.assertIsNone(cache_tags.get_entry('key', ['course:1', 'module:2']))
+
+    def test_model_changes_bump_tags(self):
+        tags = [cache_tags.tag_for_object(self.module)]
+        self.add_contents(1)
+        cache_tags.set_entry('contents', 'cached', tags)
+        text = Text.objects.get()
+        text.content = 'Changed'
+        with self.captureOnCommitCallbacks(execute=True):
+            text.save()
+        self.assertIsNone(cache_tags.get_entry('contents', tags))
+
+        tags = [cache_tags.tag_for_object(self.course)]
+        cache_tags.set_entry('course', 'cached', tags)
+        self.course.students.add(self.student)
+        self.assertIsNone(cache_tags.get_entry('course', tags))
+
+    def test_module_contents_fragment_is_invalidated(self):
+        self.course.students.add(self.student)
+        self.add_contents(1)
+        self.client.login(username='student', password='secret')
+        url = reverse('student_course_detail', args=[self.course.id])
+        self.assertContains(self.client.get(url), 'Hello')
+        Text.objects.filter(title='text 0').update(content='Bye')  # no signal: still cached
+        self.assertContains(self.client.get(url), 'Hello')
+        text = Text.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            text.save()
+        self.assertContains(self.client.get(url), 'Bye')
+
+
+class RenderedItemTests(CourseDataMixin, TestCase):
+    def test_html_is_stored_on_save(self):
+        text = Text.objects.create(owner=self.owner, title='Text', content='Hello')
+        text = Text.objects.get(pk=text.pk)
+        self.assertIn('<p>Hello</p>', text.rendered)
+
+    def test_caches_are_invalidated_once_the_html_is_stored(self):
+        text = Text.objects.create(owner=self.owner, title='Text', content='Hello')
+        Content.objects.create(module=self.module, item=text)
+        stored = []
+        invalidate = cache_tags.invalidate
+
+        def record(*tags):
+            # what a read refilling the cache right after the invalidation would find
+            stored.append(Text.objects.values_list('rendered', flat=True).get(pk=text.pk))
+            invalidate(*tags)
+
+        text.content = 'Changed'
+        with patch.object(cache_tags, 'invalidate', record):
+            with self.captureOnCommitCallbacks(execute=True):
+                text.save()
+        self.assertEqual(len(stored), 1)
+        self.assertIn('<p>Changed</p>', stored[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(text.render(), text.rendered)
+
+    def test_stale_items_are_rendered_again(self):
+        text = Text.objects.create(owner=self.owner, title='Text', content='Hello')
+        Text.objects.filter(pk=text.pk).update(rendered='', rendered_version=0)
+        call_command('render_contents', stale=True, stdout=StringIO())
+        self.assertIn('<p>Hello</p>', Text.objects.get(pk=text.pk).rendered)
+
+
+class OrderUpdateTests(CourseDataMixin, TestCase):
+    def post_order(self, orders):
+        return self.client.post(reverse('content_order'), json.dumps(orders),
+                                content_type='application/json')
+
+    def test_reorder_in_fixed_number_of_queries(self):
+        self.client.login(username='instructor', password='secret')
+        self.add_contents(30)
+        ids = list(self.module.contents.values_list('id', flat=True))
+        requested = {id: 100 - i for i, id in enumerate(ids)}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_order(requested)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(response.json()['order'], {str(id): 29 - i for i, id in enumerate(ids)})
+        self.assertEqual(list(self.module.contents.values_list('id', flat=True)), ids[::-1])
+
+    def test_other_users_contents_are_not_reordered(self):
+        self.client.login(username='student', password='secret')
+        self.add_contents(2)
+        ids = list(self.module.contents.values_list('id', flat=True))
+        response = self.post_order({ids[0]: 1, ids[1]: 0})
+        self.assertEqual(response.json()['order'], {})
+        self.assertEqual(list(self.module.contents.values_list('id', flat=True)), ids)
+
+
+class OrderFieldTests(CourseDataMixin, TestCase):
+    def test_orders_follow_existing_ones(self):
+        Module.objects.create(course=self.course, title='Fixed', order=10)
+        self.assertEqual(Module.objects.create(course=self.course, title='Next').order, 11)
+
+    def test_bulk_create_reserves_a_block(self):
+        other = Course.objects.create(owner=self.owner, subject=self.subject,
+                                      title='Flask', slug='flask', overview='Web')
+        modules = [Module(course=course, title=str(i))
+                   for i, course in enumerate([self.course, other] * 3)]
+        with CaptureQueriesContext(connection) as ctx:
+            Module.objects.bulk_create(modules)
+        queries = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        # existing sequence: update + select, new sequence: update + max + insert, then one bulk insert
+        self.assertEqual(len(queries), 6)
+        self.assertEqual(list(self.course.modules.values_list('order', flat=True)), [0, 1, 2, 3])
+        self.assertEqual(list(other.modules.values_list('order', flat=True)), [0, 1, 2])
+        self.assertEqual(Module.objects.create(course=other, title='Next').order, 3)
+
+    def test_bulk_create_with_explicit_orders_advances_once(self):
+        modules = [Module(course=self.course, title=str(i), order=i + 5) for i in range(3)]
+        with CaptureQueriesContext(connection) as ctx:
+            Module.objects.bulk_create(modules)
+        queries = [q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(queries), 2)  # one sequence update for the group, one bulk insert
+        self.assertEqual(Module.objects.create(course=self.course, title='Next').order, 8)
+
+
+class OrderFieldConcurrencyTests(CourseDataMixin, TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("threads sharing an in-memory SQLite database fail with 'table is locked' "
+                          "instead of waiting for the lock")
+        super().setUp()
+
+    def test_parallel_inserts_get_distinct_orders(self):
+        threads, per_thread = 8, 10
+        errors = []
+
+        def insert(i):
+            try:
+                for j in range(per_thread):
+                    Module.objects.create(course_id=self.course.id, title=f'{i}-{j}')
+                Module.objects.bulk_create([Module(course_id=self.course.id, title=f'{i}-bulk')
+                                            for _ in range(per_thread)])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=insert, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        orders = list(self.course.modules.values_list('order', flat=True))
+        self.assertEqual(len(orders), 1 + threads * per_thread * 2)
+        self.assertEqual(len(set(orders)), len(orders))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EnrollmentIndexTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        enrollment.cache.clear()
+
+    def test_index_follows_enrollments(self):
+        self.assertFalse(enrollment.is_enrolled(self.student, self.course.id))
+        self.course.students.add(self.student)
+        self.assertTrue(enrollment.is_enrolled(self.student, self.course.id))
+        enrollment.get_course_students(self.course.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(enrollment.is_enrolled(self.student, self.course.id))
+            self.assertEqual(enrollment.get_course_students(self.course.id), {self.student.id})
+        self.student.courses_joined.remove(self.course)
+        self.assertFalse(enrollment.is_enrolled(self.student, self.course.id))
+        self.assertEqual(enrollment.get_course_students(self.course.id), set())
+        self.student.courses_joined.add(self.course)
+        self.course.students.clear()
+        self.assertFalse(enrollment.is_enrolled(self.student, self.course.id))
+
+    def test_deleted_student_leaves_the_index(self):
+        self.course.students.add(self.student)
+        self.assertEqual(enrollment.get_course_students(self.course.id), {self.student.id})
+        self.assertTrue(enrollment.is_enrolled(self.student, self.course.id))
+        student_id = self.student.id
+        self.student.delete()
+        self.assertEqual(enrollment.get_course_students(self.course.id), set())
+        self.assertIsNone(enrollment.cache.get(enrollment.user_courses_key(student_id)))
+
+    def test_student_views_use_the_index(self):
+        self.client.login(username='student', password='secret')
+        url = reverse('student_course_detail', args=[self.course.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.course.students.add(self.student)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertContains(self.client.get(reverse('student_course_list')), 'Django')
+
+
+class CourseAPITests(CourseDataMixin, TestCase):
+    def add_courses(self, count):
+        start = Course.objects.count()
+        for i in range(start, start + count):
+            course = Course.objects.create(owner=self.owner, subject=self.subject,
+                                           title=f'Course {i}', slug=f'course-{i}', overview='')
+            Module.objects.create(course=course, title='Intro')
+
+    def test_list_query_count_is_fixed(self):
+        url = reverse('course-list')
+        self.add_courses(2)
+        with self.assertNumQueries(2):  # courses, modules
+            self.client.get(url)
+        self.add_courses(20)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['results']), 20)
+        self.assertEqual(response.json()['results'][0]['modules'][0]['title'], 'Intro')
+
+    def test_sparse_fields_skip_nested_modules(self):
+        self.add_courses(3)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('course-list'), {'fields': 'id,title'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('course-list'), {'expand': ''})
+        self.assertNotIn('modules', response.json()['results'][0])
+        response = self.client.get(reverse('course-list'), {'fields': 'title,modules.title'})
+        self.assertEqual(response.json()['results'][0], {'title': 'Course 3', 'modules': [{'title': 'Intro'}]})
+
+    def test_export_streams_every_course_in_chunks(self):
+        self.add_courses(5)
+        with patch('courses.api.views.EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get(reverse('course-export'), {'fields': 'id,modules.title'})
+            with CaptureQueriesContext(connection) as ctx:
+                courses = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(ctx), 3 * 2 + 1)  # 3 chunks of courses and modules, then the empty chunk
+        self.assertEqual([course['id'] for course in courses], sorted(Course.objects.values_list('id', flat=True)))
+        self.assertEqual(courses[0]['modules'], [{'title': 'Intro'}])
+
+        response = self.client.get(reverse('course-export'), {'ndjson': '1', 'expand': ''})
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertNotIn('modules', json.loads(lines[0]))
+
+    def test_cursor_pagination_covers_every_course(self):
+        self.add_courses(25)
+        url, ids = reverse('course-list') + '?page_size=10', []
+        while url:
+            page = self.client.get(url).json()
+            ids += [course['id'] for course in page['results']]
+            url = page['next']
+        self.assertEqual(ids, list(Course.objects.order_by('-created', '-id').values_list('id', flat=True)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CourseContentsAPITests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+        self.course.students.add(self.student)
+        self.add_contents(4)
+        self.url = reverse('course-contents', args=[self.course.id])
+        token = Token.objects.create(user=self.student)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+    def test_contents_are_served_with_etag(self):
+        response = self.client.get(self.url, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        items = [content['item'] for content in response.json()['modules'][0]['contents']]
+        self.assertIn('<p>Hello</p>', items[0])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 304)
+
+        text = Text.objects.first()
+        text.content = 'Changed'
+        with self.captureOnCommitCallbacks(execute=True):
+            text.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_payload_is_built_in_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            build_course_contents(self.course.id)
+        self.add_contents(20)
+        with CaptureQueriesContext(connection) as many:
+            build_course_contents(self.course.id)
+        self.assertEqual(len(many), len(few))
+
+    def test_items_are_only_rendered_when_expanded(self):
+        selection = FieldSelection(expand='modules.contents')
+        with CaptureQueriesContext(connection) as ctx:
+            etag, body = build_course_contents(self.course.id, selection)
+        self.assertEqual(len(ctx), 3)  # course, modules, contents
+        self.assertEqual(json.loads(body)['modules'][0]['contents'][0], {'order': 0})
+        response = self.client.get(self.url, {'fields': 'title', 'expand': ''}, **self.auth)
+        self.assertEqual(response.json(), {'title': 'Django'})
+
+    def test_only_enrolled_students(self):
+        self.course.students.remove(self.student)
+        self.assertEqual(self.client.get(self.url, **self.auth).status_code, 403)
+
+
+class TokenAuthenticationTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.course.students.add(self.student)
+        self.url = reverse('course-contents', args=[self.course.id])
+
+    def test_token_is_verified_from_cache_and_revoked(self):
+        key = self.client.post(reverse('api_token'), {'username': 'student',
+                                                      'password': 'secret'}).json()['token']
+        auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+        self.assertEqual(self.client.get(self.url, **auth).status_code, 200)
+        self.assertIsNotNone(token_cache.get(key))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, **auth)
+        self.assertFalse([q for q in ctx.captured_queries if 'authtoken_token' in q['sql']])
+
+        self.assertEqual(self.client.post(reverse('api_token_revoke'), **auth).status_code, 200)
+        self.assertIsNone(token_cache.get(key))
+        self.assertEqual(self.client.get(self.url, **auth).status_code, 401)
+
+
+class SearchTests(CourseDataMixin, TestCase):
+    def test_courses_modules_and_texts_are_indexed(self):
+        Course.objects.create(owner=self.owner, subject=self.subject, title='Flask',
+                              slug='flask', overview='Micro framework with django ideas')
+        self.assertEqual(search.search_courses('django')[0], self.course.id)  # title ranks first
+        self.assertEqual(len(search.search_courses('django')), 2)
+        self.module.description = 'Installing the framework'
+        self.module.save()
+        self.assertEqual(len(search.search_courses('install')), 1)
+        text = Text.objects.create(owner=self.owner, title='Notes', content='Middleware internals')
+        self.assertEqual(search.search_courses('middleware'), [])
+        Content.objects.create(module=self.module, item=text)
+        self.assertEqual(search.search_courses('middleware'), [self.course.id])
+        text.delete()
+        self.assertEqual(search.search_courses('middleware'), [])
+        self.assertEqual(search.search_courses('"AND OR*('), [])
+
+    def test_fts5_is_probed_once(self):
+        with patch.dict(search._has_fts5, clear=True):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(search.is_available())
+                self.assertTrue(search.is_available())
+        self.assertEqual([query['sql'] for query in queries], ['PRAGMA compile_options'])
+
+    def test_search_falls_back_without_fts5(self):
+        with patch.dict(search._has_fts5, {connection.alias: False}):
+            self.assertEqual(search.search_courses('djan'), [self.course.id])
+            self.course.title = 'Flask'
+            self.course.save()  # not indexed
+            self.assertEqual(search.search_courses('djan'), [])
+
+    def test_search_in_course_list_and_api(self):
+        self.assertContains(self.client.get(reverse('course_list'), {'q': 'djan'}), 'Django')
+        self.assertNotContains(self.client.get(reverse('course_list'), {'q': 'flask'}), 'course_detail')
+        response = self.client.get(reverse('course-search'), {'q': 'web', 'fields': 'title'})
+        self.assertEqual(response.json(), [{'title': 'Django'}])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_subject_search_is_not_crowded_out_by_other_subjects(self):
+        self.course.overview = 'A long overview of web development that mentions django only once'
+        self.course.save()
+        other = Subject.objects.create(title='Design', slug='design')
+        for i in range(search.SEARCH_LIMIT):
+            Course.objects.create(owner=self.owner, subject=other, title=f'Django {i}', slug=f'design-{i}')
+        self.assertNotIn(self.course.id, search.search_courses('django'))
+        self.assertEqual(search.search_courses('django', subject_id=self.subject.id), [self.course.id])
+        response = self.client.get(reverse('course_list_subject', args=[self.subject.slug]), {'q': 'django'})
+        self.assertEqual([course.id for course in response.context['courses']], [self.course.id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AutocompleteTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+        autocomplete.index = None
+
+    def lookup(self, prefix):
+        return [(entry.kind, entry.title) for entry in autocomplete.lookup(prefix)]
+
+    def test_prefix_lookup_follows_changes(self):
+        self.assertEqual(self.lookup('pro'), [('subject', 'Programming')])
+        self.assertEqual(self.lookup('DJ'), [('course', 'Django')])
+        with self.captureOnCommitCallbacks(execute=True):
+            course = Course.objects.create(owner=self.owner, subject=self.subject, title='Advanced Django',
+                                           slug='advanced-django', overview='')
+        with self.assertNumQueries(0):  # updated, not rebuilt
+            self.assertEqual(self.lookup('dj'), [('course', 'Advanced Django'), ('course', 'Django')])
+        self.assertEqual(self.lookup('advanced-d'), [('course', 'Advanced Django')])
+        with self.captureOnCommitCallbacks(execute=True):
+            course.delete()
+        self.assertEqual(self.lookup('dj'), [('course', 'Django')])
+        self.assertEqual(self.lookup('x'), [])
+
+    def test_top_k_after_removal(self):
+        courses = [Course.objects.create(owner=self.owner, subject=self.subject, title=f'Course {i:02}',
+                                         slug=f'course-{i}', overview='') for i in range(TOP_K + 2)]
+        self.assertEqual(len(self.lookup('c')), TOP_K)
+        with self.captureOnCommitCallbacks(execute=True):
+            courses[0].delete()
+        self.assertEqual(self.lookup('c')[-1], ('course', f'Course {TOP_K:02}'))
+
+    def test_rebuilt_when_another_process_changes_the_catalog(self):
+        self.lookup('d')
+        Course.objects.filter(id=self.course.id).update(title='Rails')  # no signal
+        cache_tags.invalidate(catalog.CATALOG_TAG)
+        self.assertEqual(self.lookup('ra'), [('course', 'Rails')])
+
+    def test_rolled_back_change_is_not_indexed(self):
+        self.lookup('d')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Course.objects.create(owner=self.owner, subject=self.subject, title='Rails', slug='rails')
+                raise RuntimeError
+        self.assertEqual(self.lookup('ra'), [])
+
+    def test_rebuilt_once_by_concurrent_lookups(self):
+        self.lookup('d')
+        cache_tags.invalidate(catalog.CATALOG_TAG)
+        lock, waiting = threading.Lock(), threading.Event()
+
+        class Lock:
+            def __enter__(self):
+                waiting.set()
+                lock.acquire()
+
+            def __exit__(self, *args):
+                lock.release()
+
+        indexes = []
+        with patch.object(autocomplete, 'lock', Lock()):
+            lock.acquire()
+            thread = threading.Thread(target=lambda: indexes.append(autocomplete.get_index()))
+            thread.start()
+            self.assertTrue(waiting.wait(5))
+            # the index the thread waited for, rebuilt by another thread
+            index = autocomplete.index = PrefixIndex()
+            autocomplete.version = autocomplete.current_version()
+            lock.release()
+            thread.join(5)
+        self.assertEqual(len(indexes), 1)
+        self.assertIs(indexes[0], index)
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('course_autocomplete'), {'q': 'djan'})
+        self.assertEqual(response.json()['results'][0]['url'], reverse('course_detail', args=['django']))
+
+
+class CounterTests(CourseDataMixin, TestCase):
+    def totals(self):
+        self.subject.refresh_from_db()
+        self.course.refresh_from_db()
+        return self.subject.total_courses, self.course.total_modules, self.course.total_students
+
+    def test_counters_follow_changes(self):
+        self.assertEqual(self.totals(), (1, 1, 0))
+        module = Module.objects.create(course=self.course, title='Models')
+        self.course.students.add(self.student)
+        self.course.students.add(self.student)  # already enrolled
+        self.owner.courses_joined.add(self.course)
+        self.assertEqual(self.totals(), (1, 2, 2))
+        module.delete()
+        self.course.students.remove(self.student, self.owner)
+        self.course.students.remove(self.student)  # not enrolled anymore
+        self.assertEqual(self.totals(), (1, 1, 0))
+        self.student.courses_joined.add(self.course)
+        self.student.courses_joined.clear()
+        self.assertEqual(self.totals(), (1, 1, 0))
+        self.course.students.add(self.student)
+        self.student.delete()
+        self.assertEqual(self.totals(), (1, 1, 0))
+
+    def test_moved_course_and_stale_instance(self):
+        other = Subject.objects.create(title='Design', slug='design')
+        stale = Course.objects.get(id=self.course.id)
+        Module.objects.create(course=self.course, title='Models')
+        stale.subject = other
+        stale.save()  # must not write back total_modules=1
+        other.refresh_from_db()
+        self.assertEqual(other.total_courses, 1)
+        self.assertEqual(self.totals(), (0, 2, 0))
+
+    def test_reconcile_repairs_drift(self):
+        Course.objects.filter(id=self.course.id).update(total_modules=7)
+        Subject.objects.update(total_courses=0)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('total_modules: 1 drifted', out.getvalue())
+        self.assertEqual(self.totals(), (1, 1, 0))
+        self.assertEqual(counters.reconcile(), {'total_courses': 0, 'total_modules': 0, 'total_students': 0})
+
+    def test_catalog_reads_the_counters(self):
+        with CaptureQueriesContext(connection) as ctx:
+            rows = catalog.build_catalog()
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual((rows['subjects'][0].total_courses, rows['courses'][0].total_modules), (1, 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTests(CourseDataMixin, QueryBudgetMixin, TestCase):
+    """Every view is requested with a cold cache, so that its queries on a cache miss are counted."""
+
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+        autocomplete.index = None
+        self.add_every_item_type()
+        self.course.students.add(self.student)
+
+    def test_owner_views(self):
+        self.owner.user_permissions.add(*Permission.objects.filter(codename='view_course'))
+        self.client.login(username='instructor', password='secret')
+        self.assertWithinQueryBudget(self.client.get(reverse('manage_course_list')))
+        self.assertWithinQueryBudget(self.client.get(reverse('module_content_list', args=[self.module.id])))
+
+    def test_catalog_views(self):
+        self.client.login(username='student', password='secret')
+        for url in (reverse('course_list'), reverse('course_list_subject', args=['programming']) + '?q=web',
+                    reverse('course_detail', args=['django']), reverse('course_autocomplete') + '?q=d'):
+            self.assertWithinQueryBudget(self.client.get(url))
+
+    def test_api_views(self):
+        token = Token.objects.create(user=self.student)
+        auth = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+        self.assertWithinQueryBudget(self.client.get(reverse('course-list'), {'expand': 'modules'}))
+        self.assertWithinQueryBudget(self.client.get(reverse('course-contents', args=[self.course.id]), **auth))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RequestMetricsTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache_tags.cache.clear()
+        view_stats.clear()
+
+    @override_settings(METRICS_HEADERS=True)
+    def test_headers(self):
+        response = self.client.get(reverse('course_list'))
+        self.assertEqual(response['X-Query-Count'], '2')  # the catalog snapshot
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        response = self.client.get(reverse('course_list'))
+        self.assertEqual(response['X-Query-Count'], '0')
+        self.assertGreater(int(response['X-Cache-Hits']), 0)
+
+    @override_settings(METRICS_HEADERS=False)
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('course_detail', args=['django']))
+        self.assertNotIn('X-Query-Count', self.client.get(reverse('course_list')))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)  # staff only
+        User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.login(username='admin', password='secret')
+        views = self.client.get(reverse('metrics')).json()['views']
+        self.assertEqual(views['course_detail']['requests'], 1)
+        self.assertEqual(views['course_list']['queries'], 2)
+        self.assertNotIn('metrics', views)
+
+    @override_settings(METRICS_HEADERS=False)
+    def test_streamed_body_is_measured(self):
+        response = self.client.get(reverse('course-export'))
+        self.assertNotIn('course-export', view_stats.snapshot())  # the courses aren't queried yet
+        self.assertEqual(json.loads(b''.join(response.streaming_content))[0]['title'], 'Django')
+        stats = view_stats.snapshot()['course-export']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_get_many_counts_each_key_once(self):
+        cache = caches['default']
+        instrument_cache(cache)
+        cache.set('a', 1)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            # LocMemCache.get_many() calls get() for each key
+            self.assertEqual(cache.get_many(['a', 'b']), {'a': 1})
+            cache.get('a')
+        finally:
+            current_metrics.reset(token)
+        self.assertEqual((metrics.cache_hits, metrics.cache_misses), (2, 1))
+        self.assertFalse(hasattr(type(cache), '_instrumented'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DatasetTests(TestCase):
+    def generate(self, prefix):
+        return dataset.generate(prefix=prefix, subjects=2, courses=5, modules=3, contents=4, students=6,
+                                enrollments=2, instructors=2, seed=7)
+
+    def test_generate(self):
+        self.assertEqual(self.generate('a'), {'users': 8, 'subjects': 2, 'courses': 5, 'modules': 15,
+                                              'contents': 60, 'enrollments': 12})
+        course = Course.objects.get(slug='a-course-0')
+        self.assertEqual((course.total_modules, course.total_students),
+                         (3, course.students.count()))
+        self.assertEqual(list(course.modules.values_list('order', flat=True)), [0, 1, 2])
+        module = course.modules.first()
+        self.assertEqual([content.order for content in module.contents.with_items()], [0, 1, 2, 3])
+        self.assertTrue(all(content.item.rendered for content in module.contents.with_items()))
+        # the sequences continue after the generated orders
+        self.assertEqual(Module.objects.create(course=course, title='Next').order, 3)
+        self.assertEqual(counters.reconcile(), {'total_courses': 0, 'total_modules': 0, 'total_students': 0})
+
+    def test_generate_is_deterministic(self):
+        self.generate('a')
+        self.generate('b')
+
+        def titles(prefix):
+            return list(Course.objects.filter(slug__startswith=prefix)
+                        .order_by('id', 'students__id', 'modules__order', 'modules__contents__order')
+                        .values_list('title', 'students__username', 'modules__contents__content_type'))
+        self.assertEqual(titles('a-'), [(title, username and username.replace('b-', 'a-'), content_type)
+                                        for title, username, content_type in titles('b-')])
+
+    def test_benchmark_views(self):
+        out = StringIO()
+        call_command('benchmark_views', sizes='4', requests=2, modules=2, contents=2, stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+        self.assertIn('course-contents', out.getvalue())
+        self.assertFalse(Course.objects.exists())  # rolled back
+
+
+class TwoTierCacheTests(TestCase):
+    def setUp(self):
+        self.stub = MemcachedStub().start()
+        self.addCleanup(self.stub.stop)
+        self.caches = {'default': {'BACKEND': 'educa.cache.TwoTierCache', 'LOCATION': self.stub.location,
+                                   'OPTIONS': {'L1_KEY_PREFIXES': [cache_tags.VERSIONED_PREFIX]}}}
+        # another process: memcached only
+        self.other = PyMemcacheCache(self.stub.location, {})
+
+    def test_tagged_entries_are_served_from_l1(self):
+        with override_settings(CACHES=self.caches):
+            cache_tags.set_entry('fragment', 'html', ['course:1'])
+            self.stub.commands.clear()
+            for _ in range(3):
+                self.assertEqual(cache_tags.get_entry('fragment', ['course:1']), 'html')
+            # only the version of the tag is read from memcached, once per lookup
+            self.assertEqual(self.stub.commands, ['get'] * 3)
+            # another process bumps the tag: the entry is looked up under a new key
+            self.other.incr(cache_tags.version_key('course:1'))
+            self.assertIsNone(cache_tags.get_entry('fragment', ['course:1']))
+
+    def test_other_keys_always_read_memcached(self):
+        with override_settings(CACHES=self.caches):
+            cache_tags.cache.set('enrollment', {1})
+            self.other.set('enrollment', {1, 2})
+            self.assertEqual(cache_tags.cache.get('enrollment'), {1, 2})
+            self.assertEqual(cache_tags.cache.get_many(['enrollment', 'missing']), {'enrollment': {1, 2}})
+
+    def test_writes_of_this_process_update_l1(self):
+        with override_settings(CACHES=self.caches):
+            cache = cache_tags.cache
+            cache.set('tagged:a', 1)
+            cache.set('tagged:a', 2)
+            self.assertEqual(cache.get('tagged:a'), 2)
+            cache.delete('tagged:a')
+            self.assertIsNone(cache.get('tagged:a'))
+            self.other.set('tagged:b', 'theirs')
+            self.assertFalse(cache.add('tagged:b', 'mine'))
+            self.assertEqual(cache.get_many(['tagged:b']), {'tagged:b': 'theirs'})
+
+    def test_unreachable_server_is_a_miss(self):
+        unreachable = {'default': {**self.caches['default'], 'LOCATION': '127.0.0.1:1'}}
+        with override_settings(CACHES=unreachable):
+            cache_tags.cache.set('tagged:a', 1)
+            self.assertIsNone(cache_tags.cache.get('key'))
+
+    def test_memcache_status_stats(self):
+        with override_settings(CACHES=self.caches):
+            cache_tags.cache.set('key', 1)
+            stats = get_cache_stats()
+        self.assertEqual([(entry['address'], entry['stats']['curr_items']) for entry in stats],
+                         [(self.stub.location, 1)])
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_cache', stub=True, gets=10, courses=5, stdout=out)
+        self.assertIn('memcached + L1', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StampedeTests(TestCase):
+    def setUp(self):
+        cache_tags.cache.clear()
+        self.calls = 0
+
+    def compute(self, value='new', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def run_concurrently(self, target, count=8):
+        results = []
+        barrier = threading.Barrier(count)
+
+        def run():
+            barrier.wait()
+            results.append(target())
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_one_recompute_per_key_under_concurrency(self):
+        results = self.run_concurrently(lambda: stampede.get_or_compute('key', self.compute(delay=0.2), 60))
+        self.assertEqual((self.calls, results), (1, ['new'] * 8))
+
+    def test_stale_entry_is_served_while_it_is_recomputed(self):
+        stampede.set_value('key', 'old', -1)  # expired, but still stored
+        cache_tags.cache.add(stampede.lock_key('key'), 1)  # another request is recomputing it
+        self.assertEqual(stampede.get_or_compute('key', self.compute(), 60), 'old')
+        self.assertEqual(self.calls, 0)
+        cache_tags.cache.delete(stampede.lock_key('key'))
+        self.assertEqual(stampede.get_or_compute('key', self.compute(), 60), 'new')
+        self.assertEqual(stampede.get_or_compute('key', self.compute('newer'), 60), 'new')
+
+    def test_refresh_by_another_process_is_not_repeated(self):
+        with MemcachedStub() as stub:
+            port = stub.location.rsplit(':', 1)[1]
+            # two processes: each has its own L1 in front of the same memcached
+            first = TwoTierCache(f'127.0.0.1:{port}', {'OPTIONS': {'L1_KEY_PREFIXES': ['tagged:']}})
+            second = TwoTierCache(f'localhost:{port}', {'OPTIONS': {'L1_KEY_PREFIXES': ['tagged:']}})
+            self.addCleanup(first.l1.clear)
+            self.addCleanup(second.l1.clear)
+            with patch.object(stampede, 'cache', first):
+                stampede.set_value('tagged:key', 'old', -1)  # expired, but still stored
+            self.assertEqual(second.get('tagged:key').value, 'old')  # in the second process's L1
+            with patch.object(stampede, 'cache', first):
+                self.assertEqual(stampede.get_or_compute('tagged:key', self.compute(), 60), 'new')
+            with patch.object(stampede, 'cache', second):
+                self.assertEqual(stampede.get_or_compute('tagged:key', self.compute('again'), 60), 'new')
+                self.assertEqual(stampede.get_or_compute('tagged:key', self.compute('again'), 60), 'new')
+        self.assertEqual(self.calls, 1)
+
+    def test_early_refresh(self):
+        stampede.set_value('key', 'old', 5, compute_time=1.0)
+        with patch('courses.stampede.random.random', return_value=0.5):
+            self.assertEqual(stampede.get_or_compute('key', self.compute(), 60), 'old')
+        with patch('courses.stampede.random.random', return_value=1e-9):
+            self.assertEqual(stampede.get_or_compute('key', self.compute(), 60), 'new')
+
+    def test_catalog_is_rebuilt_once(self):
+        def build_catalog():
+            self.calls += 1
+            time.sleep(0.2)
+            return {'subjects': [], 'courses': ['course']}
+        with patch('courses.catalog.build_catalog', build_catalog):
+            results = self.run_concurrently(catalog.get_courses)
+        self.assertEqual((self.calls, results), (1, [['course']] * 8))
+
+
+class BlobStorageTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.other_module = Module.objects.create(course=self.course, title='Slides')
+        self.client.login(username='instructor', password='secret')
+
+    def upload(self, module, data, name='slides.pdf', id=None):
+        args = [module.id, 'file'] + ([id] if id else [])
+        url = reverse('module_content_update' if id else 'module_content_create', args=args)
+        self.client.post(url, {'title': name, 'file': SimpleUploadedFile(name, data)})
+        return File.objects.latest('id') if id is None else File.objects.get(id=id)
+
+    def blob_files(self):
+        root = blob_storage.path(BLOB_DIRECTORY)
+        return sorted(name for directory, _, names in os.walk(root) for name in names if name != '.lock')
+
+    def test_same_bytes_are_stored_once(self):
+        first = self.upload(self.module, b'%PDF lecture')
+        second = self.upload(self.other_module, b'%PDF lecture', name='copy.PDF')
+        self.assertEqual(first.file.name, second.file.name)
+        digest = hashlib.sha256(b'%PDF lecture').hexdigest()
+        self.assertEqual(first.file.name, f'blobs/{digest[:2]}/{digest}.pdf')
+        self.assertEqual(self.blob_files(), [f'{digest}.pdf'])
+        self.assertEqual(Blob.objects.get().references, 2)
+        self.assertEqual(second.file.read(), b'%PDF lecture')
+
+    def test_deleting_content_releases_a_reference(self):
+        self.upload(self.module, b'shared')
+        self.upload(self.other_module, b'shared')
+        for content in Content.objects.filter(content_type__model='file'):
+            with self.captureOnCommitCallbacks(execute=True):  # the file is deleted on commit
+                self.client.post(reverse('module_content_delete', args=[content.id]))
+            if Blob.objects.exists():
+                self.assertEqual(Blob.objects.get().references, 1)
+                self.assertEqual(len(self.blob_files()), 1)
+        self.assertEqual(self.blob_files(), [])
+
+    def test_replacing_the_file_releases_the_old_blob(self):
+        item = self.upload(self.module, b'v1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(self.module, b'v2', id=item.id)
+        self.assertEqual(list(Blob.objects.values_list('references', flat=True)), [1])
+        self.assertEqual(self.blob_files(), [f"{hashlib.sha256(b'v2').hexdigest()}.pdf"])
+
+    def test_release_running_between_the_upload_and_its_reference(self):
+        self.upload(self.module, b'shared')
+        content = Content.objects.get(content_type__model='file')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('module_content_delete', args=[content.id]))
+        acquire = Blob.objects.acquire
+
+        def release_first(name, content=None):
+            # the upload found the file in place, the release deletes it before the reference is taken
+            for callback in callbacks:
+                callback()
+            self.assertEqual(self.blob_files(), [])
+            acquire(name, content)
+
+        with patch.object(Blob.objects, 'acquire', side_effect=release_first):
+            item = self.upload(self.other_module, b'shared')
+        self.assertEqual(Blob.objects.get().references, 1)
+        self.assertEqual(Blob.objects.get().size, len(b'shared'))
+        self.assertEqual(item.file.read(), b'shared')
+
+    def test_blob_uploaded_again_before_the_release_commits_is_kept(self):
+        self.upload(self.module, b'shared')
+        content = Content.objects.get(content_type__model='file')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('module_content_delete', args=[content.id]))
+        # the same bytes are uploaded between the release and its deletion of the file
+        item = self.upload(self.other_module, b'shared')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Blob.objects.get().references, 1)
+        self.assertEqual(item.file.read(), b'shared')
+
+
+@patch.object(uploads, 'CHUNK_SIZE', 4)
+class ChunkedUploadTests(CourseDataMixin, TestCase):
+    data = b'0123456789'  # chunks of 4, 4 and 2 bytes
+
+    def setUp(self):
+        super().setUp()
+        for setting in ('MEDIA_ROOT', 'CHUNKED_UPLOAD_DIR'):
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            self.enterContext(override_settings(**{setting: directory}))
+        self.client.login(username='instructor', password='secret')
+
+    def start(self, checksum=None, module=None):
+        response = self.client.post(reverse('upload-list'), {
+            'module': (module or self.module).id, 'model_name': 'file', 'title': 'Slides',
+            'filename': 'slides.pdf', 'size': len(self.data),
+            'checksum': checksum or hashlib.sha256(self.data).hexdigest()})
+        return response
+
+    def send(self, id, offset, data):
+        return self.client.put(reverse('upload-chunk', args=[id]) + f'?offset={offset}', data,
+                               content_type='application/octet-stream')
+
+    def complete(self, id):
+        with self.captureOnCommitCallbacks(execute=True):  # the temporary file is removed on commit
+            return self.client.post(reverse('upload-complete', args=[id]))
+
+    def test_upload_resumes_after_an_interruption(self):
+        id = self.start().json()['id']
+        self.assertEqual(self.send(id, 0, self.data[:4]).json(), {'offset': 4})
+        # the second chunk never arrived, the third is rejected with the offset to resume from
+        response = self.send(id, 8, self.data[8:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 4)
+        self.assertEqual(self.client.get(reverse('upload-detail', args=[id])).json()['offset'], 4)
+        # a chunk sent again after its response was lost is accepted without being written twice
+        self.assertEqual(self.send(id, 0, self.data[:4]).json(), {'offset': 4})
+        self.send(id, 4, self.data[4:8])
+        self.assertEqual(self.send(id, 8, self.data[8:]).json(), {'offset': 10})
+        response = self.complete(id)
+        self.assertEqual(response.status_code, 201)
+        content = Content.objects.get(id=response.json()['content'])
+        self.assertEqual((content.module, content.item.owner), (self.module, self.owner))
+        self.assertEqual(content.item.file.read(), self.data)
+        self.assertEqual(Blob.objects.get().name, content.item.file.name)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(os.listdir(uploads.get_directory()), [])
+
+    def test_chunks_must_have_the_chunk_size(self):
+        id = self.start().json()['id']
+        self.assertEqual(self.send(id, 0, self.data[:3]).status_code, 409)
+        self.assertEqual(self.send(id, 0, self.data[:5]).status_code, 409)
+
+    def test_checksum_mismatch_restarts_the_upload(self):
+        id = self.start(checksum=hashlib.sha256(b'other').hexdigest()).json()['id']
+        for offset in range(0, len(self.data), 4):
+            self.send(id, offset, self.data[offset:offset + 4])
+        response = self.complete(id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        stored = [name for _, _, names in os.walk(blob_storage.path(BLOB_DIRECTORY)) for name in names]
+        self.assertEqual(stored, ['.lock'])
+
+    def test_retry_finishing_while_a_chunk_is_written(self):
+        id = self.start().json()['id']
+        write_chunk = uploads.write_chunk
+        retries = []
+
+        def slow_write(upload, offset, stream, length):
+            # the row isn't locked meanwhile: the client gave up waiting and sent the chunk again
+            if not retries:
+                retries.append(None)
+                retries[0] = self.send(id, offset, self.data[offset:offset + length]).json()
+            write_chunk(upload, offset, stream, length)
+
+        with patch.object(uploads, 'write_chunk', slow_write):
+            self.assertEqual(self.send(id, 0, self.data[:4]).json(), {'offset': 4})
+        self.assertEqual(retries, [{'offset': 4}])
+        self.send(id, 4, self.data[4:8])
+        self.send(id, 8, self.data[8:])
+        self.assertEqual(self.complete(id).status_code, 201)
+        self.assertEqual(File.objects.get().file.read(), self.data)
+
+    def test_upload_completed_while_its_file_is_stored(self):
+        id = self.start().json()['id']
+        for offset in range(0, len(self.data), 4):
+            self.send(id, offset, self.data[offset:offset + 4])
+        store = uploads.store
+        completed = []
+
+        def slow_store(upload):
+            name = store(upload)
+            if not completed:
+                completed.append(None)
+                completed[0] = self.complete(id).status_code
+            return name
+
+        with patch.object(uploads, 'store', slow_store):
+            self.assertEqual(self.complete(id).status_code, 404)
+        self.assertEqual(completed, [201])
+        self.assertEqual(File.objects.count(), 1)
+        self.assertEqual(Blob.objects.get().references, 1)
+
+    def test_incomplete_upload_is_not_created(self):
+        id = self.start().json()['id']
+        self.send(id, 0, self.data[:4])
+        self.assertEqual(self.complete(id).status_code, 409)
+        self.assertFalse(File.objects.exists())
+
+    def test_abandoned_uploads_expire(self):
+        stale = self.start().json()['id']
+        fresh = self.start().json()['id']
+        Upload.objects.filter(id=stale).update(created=timezone.now() - timedelta(days=2))
+        orphan = os.path.join(uploads.get_directory(), 'orphan.part')
+        open(orphan, 'wb').close()
+        os.utime(orphan, (time.time() - 3 * 86400,) * 2)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_uploads', stdout=out)
+        self.assertIn('1 uploads expired', out.getvalue())
+        self.assertEqual([str(id) for id in Upload.objects.values_list('id', flat=True)], [fresh])
+        self.assertEqual(os.listdir(uploads.get_directory()), [f'{fresh}.part'])
+
+    def test_only_the_owner_uploads(self):
+        other = Course.objects.create(owner=self.student, subject=self.subject, title='Other', slug='other')
+        response = self.start(module=Module.objects.create(course=other, title='Intro'))
+        self.assertEqual(response.status_code, 400)
+        id = self.start().json()['id']
+        self.client.login(username='student', password='secret')
+        self.assertEqual(self.send(id, 0, self.data[:4]).status_code, 404)
+
+
+def make_image(width, height, mode='RGB', format='PNG'):
+    output = BytesIO()
+    PILImage.new(mode, (width, height), 'red').save(output, format)
+    return output.getvalue()
+
+
+@override_settings(IMAGE_VARIANT_WORKERS=0)
+class ImageVariantTests(CourseDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client.login(username='instructor', password='secret')
+
+    def upload(self, data, name='photo.png'):
+        with self.captureOnCommitCallbacks(execute=True):  # variants are scheduled on commit
+            self.client.post(reverse('module_content_create', args=[self.module.id, 'image']),
+                             {'title': 'Photo', 'file': SimpleUploadedFile(name, data)})
+        return Image.objects.latest('id')
+
+    def variants(self, item):
+        directory = images.variant_directory(images.get_digest(item.file.name))
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_variants_are_generated_narrower_than_the_image(self):
+        item = self.upload(make_image(800, 400))
+        self.assertEqual(self.variants(item), ['160.jpg', '160.webp', '320.jpg', '320.webp',
+                                               '640.jpg', '640.webp', '800.jpg', '800.webp'])
+        path = images.variant_path(images.get_digest(item.file.name), 320, 'webp')
+        with PILImage.open(path) as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (320, 160)))
+        html = item.render()
+        self.assertIn(f'{images.variant_url(images.get_digest(item.file.name), 640, "webp")} 640w', html)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(f'src="{item.file.url}"', html)
+
+    def test_transparent_images_fall_back_to_png(self):
+        item = self.upload(make_image(400, 400, mode='RGBA'))
+        self.assertIn('320.png', self.variants(item))
+        self.assertNotIn('320.jpg', self.variants(item))
+
+    def test_oversized_images_are_shown_as_they_are(self):
+        with patch.object(PILImage, 'MAX_IMAGE_PIXELS', 1000):  # 800x400 is over twice the limit
+            item = self.upload(make_image(800, 400))
+            self.assertEqual(Image.objects.count(), 1)
+            self.assertNotIn('srcset', item.render())
+            self.assertEqual(self.variants(item), [])
+            digest = images.get_digest(item.file.name)
+            response = self.client.get(images.variant_url(digest, 320, 'webp'))
+            self.assertRedirects(response, item.file.url, fetch_redirect_response=False)
+
+    def test_small_images_have_no_srcset(self):
+        item = self.upload(make_image(200, 100))
+        self.assertNotIn('srcset', item.render())
+        self.assertEqual(self.variants(item), ['160.jpg', '160.webp'])
+
+    def test_variants_are_shared_and_deleted_with_the_blob(self):
+        first = self.upload(make_image(400, 200))
+        second = self.upload(make_image(400, 200), name='copy.png')
+        self.assertEqual(first.file.name, second.file.name)
+        for content in Content.objects.filter(content_type__model='image'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('module_content_delete', args=[content.id]))
+            self.assertEqual(bool(self.variants(first)), Image.objects.exists())
+
+    def test_view_serves_variant_or_schedules_it(self):
+        item = self.upload(make_image(400, 200))
+        digest = images.get_digest(item.file.name)
+        response = self.client.get(images.variant_url(digest, 320, 'webp'))
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/webp'))
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+        images.delete_variants(item.file.name)
+        # served the original while the missing variant is generated
+        self.assertRedirects(self.client.get(images.variant_url(digest, 320, 'webp')), item.file.url,
+                             fetch_redirect_response=False)
+        self.assertIn('320.webp', self.variants(item))
+        self.assertEqual(self.client.get(images.variant_url(digest, 1280, 'webp')).status_code, 302)
+        self.assertNotIn('1280.webp', self.variants(item))
+        self.assertEqual(self.client.get(images.variant_url('0' * 64, 320, 'webp')).status_code, 404)
+        self.assertEqual(self.client.get(images.variant_url(digest, 320, 'gif')).status_code, 404)
+
+    @override_settings(IMAGE_VARIANT_WORKERS=1)
+    def test_variants_are_generated_in_the_pool(self):
+        item = self.upload(make_image(400, 200))
+        images.schedule(item.file.name).result(timeout=60)
+        self.assertIn('320.webp', self.variants(item))
+
+    def test_job_finishing_after_the_release_leaves_no_variants(self):
+        item = self.upload(make_image(400, 200))
+        name, directory = item.file.name, images.variant_directory(images.get_digest(item.file.name))
+        images.delete_variants(name)
+        content = Content.objects.get(content_type__model='image')
+        exif_transpose = images.ImageOps.exif_transpose
+
+        def release_meanwhile(image):
+            # the blob is released while the job is running, after it opened the source
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('module_content_delete', args=[content.id]))
+            return exif_transpose(image)
+
+        with patch.object(images.ImageOps, 'exif_transpose', side_effect=release_meanwhile):
+            images.generate(blob_storage.path(name), directory)
+        self.assertFalse(os.path.exists(blob_storage.path(name)))
+        self.assertFalse(os.path.exists(directory))
+
+    def test_broken_pool_is_replaced(self):
+        item = self.upload(make_image(400, 200))
+        images.delete_variants(item.file.name)
+        broken = Mock(submit=Mock(side_effect=BrokenProcessPool('a worker died')))
+        with override_settings(IMAGE_VARIANT_WORKERS=1), patch.object(images, '_executor', broken):
+            url = images.variant_url(images.get_digest(item.file.name), 320, 'webp')
+            self.assertRedirects(self.client.get(url), item.file.url, fetch_redirect_response=False)
+            self.assertIsNone(images._executor)
+            broken.shutdown.assert_called_once_with(wait=False)
@@ -18,6 +18,10 @@ urlpatterns = [
     path('module/<int:module_id>/', views.ModuleContentListView.as_view(), name='module_content_list'),
     path('module/order/', views.ModuleOrderView.as_view(), name='module_order'),
     path('content/order/', views.ContentOrderView.as_view(), name='content_order'),
+    # search-as-you-type suggestions for the course list
+    path('autocomplete/', views.course_autocomplete, name='course_autocomplete'),
+    # resized variants of Image contents, see images.py
+    path('image/<str:digest>/<int:width>.<str:extension>', views.image_variant, name='image_variant'),
     # For displaying all courses for a subject and display a single course overview.
     path('subject/<slug:subject>/', views.CourseListView.as_view(), name='course_list_subject'),
     path('<slug:slug>/', views.CourseDetailView.as_view(), name='course_detail'),
@@ -10,11 +10,19 @@ from django.forms.models import modelform_factory
 from django.apps import apps
 from .models import Content, Module
 from braces.views import CsrfExemptMixin, JsonRequestResponseMixin
-from django.db.models import Count
-from .models import Subject
 from django.views.generic.detail import DetailView
 from students.forms import CourseEnrollForm
-from django.core.cache import cache
+from django.http import Http404, JsonResponse
+from .autocomplete import autocomplete, TOP_K
+from . import catalog, cache_tags, search
+from .cache_tags import tag_for
+from django.db import models, transaction
+from django.db.models import Case, When, Value, OuterRef, Subquery
+from educa.metrics import query_budget
+import os
+from django.http import FileResponse
+from . import images
+from .storage import blob_storage
 """
 Mixins are a special kind of multiple inheritance for a class. You can use them
 to provide common discrete functionality that, when added to other mixins, allows
@@ -63,6 +71,12 @@ class OwnerCourseEditMixin(OwnerCourseMixin, OwnerEditMixin):
 class ManageCourseListView(OwnerCourseMixin, ListView):
     template_name = 'courses/manage/course/list.html'
     permission_required = 'courses.view_course'
+    query_budget = 6  # session, user, two permission queries, count and courses
+
+    def get_queryset(self):
+        # the link to the contents of each course's first module, without a query per course
+        first_module = Module.objects.filter(course=OuterRef('pk')).order_by('order').values('id')[:1]
+        return super().get_queryset().annotate(first_module_id=Subquery(first_module))
 
 
 class CourseCreateView(OwnerCourseEditMixin, CreateView):
@@ -165,7 +179,9 @@ class ContentDeleteView(View, TemplateResponseMixin):
         try:
             content = get_object_or_404(Content, id=id, module__course__owner=request.user)
             module = content.module
-            # To delete the related Text, Video, Image, or File object and then delete the Content object
+            # To delete the related Text, Video, Image, or File object and then delete the Content object.
+            # The stored file of a File or Image is shared by every upload of the same bytes,
+            # deleting the item only releases its reference (see Blob in models.py)
             content.item.delete()
             content.delete()
         except Content.DoesNotExist:
@@ -179,79 +195,142 @@ class ContentDeleteView(View, TemplateResponseMixin):
 class ModuleContentListView(TemplateResponseMixin, View):
     """List the contents of a specific module"""
     template_name = 'courses/manage/module/content_list.html'
+    query_budget = 8  # session, user, module, modules of the course, contents and one query per type of item
 
     def get(self, request, module_id):
         # gets the Module object with the given ID that belongs to the current user
-        module = get_object_or_404(Module, id=module_id, course__owner=request.user)
-        return self.render_to_response({'module': module})
+        module = get_object_or_404(Module.objects.select_related('course'), id=module_id,
+                                   course__owner=request.user)
+        # resolve every content's item up front, so the template doesn't query once per content
+        return self.render_to_response({'module': module,
+                                        'contents': module.contents.with_items()})
 
 
-class ModuleOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
-    """To provide a simple way to reorder course's modules"""
+class OrderUpdateMixin(CsrfExemptMixin, JsonRequestResponseMixin):
+    """Reorders objects from a JSON body of {id: order}, checking ownership once and writing
+    every new order with a single UPDATE ... CASE statement inside a transaction."""
+    model = None
+    owner_lookup = None  # lookup from the model to the course owner
+    parent_fields = {}  # {model: field} of the parents whose cache tags go stale on reorder
 
     def post(self, request):
-        # To re-order every module for that particular course
-        for id, order in self.request_json.items():
-            Module.objects.filter(id=id, course__owner=request.user).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+        try:
+            requested = {int(id): int(order) for id, order in self.request_json.items()}
+        except (AttributeError, TypeError, ValueError):
+            return self.render_bad_request_response({'error': 'Expected a JSON object of {id: order}'})
+        with transaction.atomic():
+            # only keep the objects that belong to the current user, with a single query
+            owned = self.model.objects.select_for_update().filter(
+                id__in=requested, **{self.owner_lookup: request.user}
+            ).values_list('id', *self.parent_fields.values())
+            owned = {row[0]: row[1:] for row in owned}
+            # normalize to consecutive orders starting at 0, ties are broken by id
+            ids = sorted(owned, key=lambda id: (requested[id], id))
+            orders = {id: order for order, id in enumerate(ids)}
+            if orders:
+                self.model.objects.filter(id__in=orders).update(order=Case(
+                    *[When(id=id, then=Value(order)) for id, order in orders.items()],
+                    output_field=models.PositiveIntegerField()
+                ))
+        # update() doesn't send post_save, so invalidate the cached parents here
+        cache_tags.invalidate(*{tag_for(parent, parents[i])
+                                for parents in owned.values()
+                                for i, parent in enumerate(self.parent_fields)})
+        return self.render_json_response({'saved': 'OK', 'order': orders})
+
+
+class ModuleOrderView(OrderUpdateMixin, View):
+    """To provide a simple way to reorder course's modules"""
+    model = Module
+    owner_lookup = 'course__owner'
+    parent_fields = {Course: 'course_id'}
 
 
-class ContentOrderView(CsrfExemptMixin, JsonRequestResponseMixin, View):
+class ContentOrderView(OrderUpdateMixin, View):
     """To provide a simple way to reorder modules' contents."""
-
-    def post(self, request):
-        # To re-order every content for that particular content
-        for id, order in self.request_json.items():
-            Content.objects.filter(id=id, module__course__owner=request.user).update(order=order)
-        return self.render_json_response({'saved': 'OK'})
+    model = Content
+    owner_lookup = 'module__course__owner'
+    parent_fields = {Module: 'module_id', Course: 'module__course_id'}
 
 
 class CourseListView(TemplateResponseMixin, View):
     """Display all available courses for students to browse and enroll on them."""
     model = Course
     template_name = 'courses/course/list.html'
+    query_budget = 5  # session, user, the two catalog queries on a cache miss and the search
 
     def get(self, request, subject=None):
-        # You retrieve all subjects, using the ORM's annotate() method with the Count() aggregation function
-        # to include the total number of courses for each subject. Same with modules for courses.
-        subjects = cache.get('all_subjects')
-        if not subjects:  # if it hasn't been cached yet or timed out, you set it
-            # cache.set(key, value, timeout)
-            subjects = Subject.objects.annotate(total_courses=Count('courses'))
-            cache.set('all_subjects', subjects)
-
-        all_courses = Course.objects.annotate(total_modules=Count('modules'))
-
+        # The catalog is served from a precomputed snapshot of compact rows (see catalog.py),
+        # holding the total number of courses for each subject and of modules for each course.
+        subjects = catalog.get_subjects()
         if subject:
-            # If given, retrieve the corresponding subject object
-            subject = get_object_or_404(Subject, slug=subject)
-            # you'll want to cache something that is based on dynamic data. In these cases, you have to
-            # build dynamic keys that contain all the information required to uniquely identify the cached data.
-            key = f'subject_{subject.id}_courses'  # caching based on dynamic data
-            courses = cache.get(key)
-            if not courses:
-                courses = all_courses.filter(subject=subject)  # limit the query by the courses belonging to the subject
-                cache.set(key, courses)
+            # If given, retrieve the corresponding subject row
+            subject = next((s for s in subjects if s.slug == subject), None)
+            if subject is None:
+                raise Http404('No Subject matches the given query.')
+            courses = catalog.get_courses(subject.id)
         else:
-            courses = cache.get('all_courses')
-            if not courses:
-                courses = all_courses
-                cache.set('all_courses', courses)  # to set an "all_courses" key to all_courses
+            courses = catalog.get_courses()
+        query = request.GET.get('q', '').strip()
+        if query:
+            # keep the courses matching the search, best match first
+            matches = search.search_courses(query, subject_id=subject.id if subject else None)
+            ranks = {id: rank for rank, id in enumerate(matches)}
+            courses = sorted((course for course in courses if course.id in ranks),
+                             key=lambda course: ranks[course.id])
         return self.render_to_response({'subjects': subjects,
                                         'subject': subject,
-                                        'courses': courses})
+                                        'courses': courses,
+                                        'query': query})
+
+
+@query_budget(2)  # building the index on first use
+def course_autocomplete(request):
+    """Returns the subjects and courses whose title, title words or slug start with ?q="""
+    try:
+        limit = min(int(request.GET.get('limit', TOP_K)), TOP_K)
+    except ValueError:
+        limit = TOP_K
+    entries = autocomplete.lookup(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [{'kind': entry.kind, 'id': entry.id, 'title': entry.title,
+                                      'url': entry.url} for entry in entries]})
+
+
+@query_budget(0)
+def image_variant(request, digest, width, extension):
+    """Serves a resized variant of an Image. A missing one is scheduled for generation and the
+    original is served meanwhile, the request doesn't wait for it."""
+    if not images.is_digest(digest) or extension not in images.FORMATS:
+        raise Http404
+    path = images.variant_path(digest, width, extension)
+    if os.path.exists(path):
+        response = FileResponse(open(path, 'rb'), content_type=images.CONTENT_TYPES[extension])
+        # named after the content of the source, a variant never changes
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+    source = images.find_source(digest)
+    if source is None:
+        raise Http404
+    widths, fallback = images.describe(blob_storage.path(source))
+    if width in widths and extension in ('webp', fallback):
+        images.schedule(source)
+    return redirect(blob_storage.url(source))
 
 
 class CourseDetailView(DetailView):
     """Display a single course overview"""
     model = Course
     template_name = 'courses/course/detail.html'
+    query_budget = 3  # session, user and course
     # Django's DetailView expects a primary key (pk) or slug URL parameter to retrieve
     # a single object for the given model. To be sent in the view template.
 
     # To include the enrollment form in the context for rendering templates.
     # You initialize the hidden course field of the form with the current Course object
     # so that it can be submitted directly
+    def get_queryset(self):
+        return super().get_queryset().select_related('subject', 'owner')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['enroll_form'] = CourseEnrollForm(initial={'course': self.object})
@@ -9,8 +9,7 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'educa.settings')
 
-application = get_asgi_application()
+# HTTP requests go to Django, websocket connections to the chat consumers (see routing.py)
+from educa.routing import application  # noqa: E402,F401
@@ -0,0 +1,175 @@
+"""
+Two-tier cache backend: a size-bounded in-process LRU (L1) in front of memcached (L2).
+Memcached is reached through a pymemcache HashClient with a connection pool per server, shared by the
+threads of the process, instead of python-memcached's single connection per thread.
+
+Only keys starting with one of L1_KEY_PREFIXES are kept in L1. Those must be keys whose value never
+changes once written: the entries of courses.cache_tags embed the current versions of the tags they
+depend on, so bumping a tag's version key (which is never kept in L1) moves readers to a new key in
+every process at once, and the entries left behind in L1 simply expire. Other keys (sessions, version
+keys, enrollment sets) always go to memcached. Writes and deletes of this process update L1 directly.
+L1 hands out the stored object itself, without unpickling a copy, so readers must not modify it.
+
+    CACHES = {'default': {
+        'BACKEND': 'educa.cache.TwoTierCache',
+        'LOCATION': '127.0.0.1:11211',
+        'OPTIONS': {'L1_KEY_PREFIXES': ['tagged:'], 'L1_MAX_ENTRIES': 2000, 'L1_TIMEOUT': 60},
+    }}
+"""
+import threading
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.memcached import PyMemcacheCache
+from pymemcache import HashClient
+from pymemcache.exceptions import MemcacheError
+from courses.lru import LRUCache
+
+# shared by the backend instances of every thread, which Django creates per thread
+_l1_caches = {}
+_clients = {}
+_lock = threading.Lock()
+_missing = object()
+
+
+class StatsHashClient(HashClient):
+    """HashClient that reports the stats of each server like python-memcached's get_stats(),
+    which the memcache_status admin page reads."""
+
+    def get_stats(self):
+        stats = []
+        for server, client in self.clients.items():
+            try:
+                server_stats = client.stats()
+            except (MemcacheError, OSError):
+                continue  # the page lists the servers that answer
+            stats.append((server, {key.decode(): value for key, value in server_stats.items()}))
+        return stats
+
+
+class TwoTierCache(PyMemcacheCache):
+    def __init__(self, server, params):
+        options = dict(params.get('OPTIONS') or {})
+        self.l1_key_prefixes = tuple(options.pop('L1_KEY_PREFIXES', ()))
+        l1_max_entries = options.pop('L1_MAX_ENTRIES', 1000)
+        l1_timeout = options.pop('L1_TIMEOUT', 60)
+        # like python-memcached, an unreachable server is a cache miss rather than an error
+        options.setdefault('ignore_exc', True)
+        options.setdefault('use_pooling', True)
+        options.setdefault('max_pool_size', 16)
+        super().__init__(server, {**params, 'OPTIONS': options})
+        self._class = StatsHashClient
+        self._location = server if isinstance(server, str) else ','.join(server)
+        with _lock:
+            self.l1 = _l1_caches.setdefault(self._location, LRUCache(l1_max_entries, l1_timeout))
+
+    @property
+    def _cache(self):
+        client = _clients.get(self._location)
+        if client is None:
+            with _lock:
+                client = _clients.setdefault(self._location, self._class(self.client_servers, **self._options))
+        return client
+
+    def in_l1(self, key):
+        return key.startswith(self.l1_key_prefixes)
+
+    def l1_timeout(self, timeout):
+        # an L1 entry never outlives the memcached one
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self.l1.timeout
+        return min(timeout, self.l1.timeout)
+
+    def store_l1(self, key, value, timeout):
+        timeout = self.l1_timeout(timeout)
+        if timeout > 0:
+            self.l1.set(key, value, timeout)
+        else:
+            self.l1.delete(key)
+
+    def get(self, key, default=None, version=None):
+        if not self.in_l1(key):
+            return super().get(key, default, version)
+        full_key = self.make_and_validate_key(key, version)
+        value = self.l1.get(full_key, _missing)
+        if value is not _missing:
+            return value
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            return default
+        self.store_l1(full_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_shared(self, key, default=None, version=None):
+        """Reads the value stored in memcached, where the other processes see it, and keeps it in L1.
+        For the callers that must not trust this process's own copy, e.g. courses.stampede."""
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            return default
+        if self.in_l1(key):
+            self.store_l1(self.make_and_validate_key(key, version), value, DEFAULT_TIMEOUT)
+        return value
+
+    def get_many(self, keys, version=None):
+        values, remote = {}, []
+        for key in keys:
+            value = self.l1.get(self.make_and_validate_key(key, version), _missing) if self.in_l1(key) else _missing
+            if value is _missing:
+                remote.append(key)
+            else:
+                values[key] = value
+        if remote:
+            found = super().get_many(remote, version)
+            for key, value in found.items():
+                if self.in_l1(key):
+                    self.store_l1(self.make_and_validate_key(key, version), value, DEFAULT_TIMEOUT)
+            values.update(found)
+        return values
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version)
+        if self.in_l1(key):
+            self.store_l1(self.make_and_validate_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout, version)
+        for key, value in data.items():
+            if self.in_l1(key) and key not in failed:
+                self.store_l1(self.make_and_validate_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version)
+        if self.in_l1(key):
+            full_key = self.make_and_validate_key(key, version)
+            if added:
+                self.store_l1(full_key, value, timeout)
+            else:
+                self.l1.delete(full_key)  # memcached holds another process's value
+        return added
+
+    def delete(self, key, version=None):
+        self.l1.delete(self.make_and_validate_key(key, version))
+        return super().delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self.l1.delete(self.make_and_validate_key(key, version))
+        super().delete_many(keys, version)
+
+    def incr(self, key, delta=1, version=None):
+        self.l1.delete(self.make_and_validate_key(key, version))
+        return super().incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self.l1.delete(self.make_and_validate_key(key, version))
+        return super().decr(key, delta, version)
+
+    def clear(self):
+        self.l1.clear()
+        return super().clear()
+
+    def close(self, **kwargs):
+        # the pooled client is shared by every thread and request of the process
+        pass
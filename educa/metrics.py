@@ -0,0 +1,229 @@
+"""
+Per-request instrumentation: number of queries, ORM time, template render time and cache hits/misses.
+RequestMetricsMiddleware collects them for every request. With METRICS_HEADERS (DEBUG by default) they're
+returned in X-Query-Count, X-Cache-Hits, X-Cache-Misses and Server-Timing headers, and they're always
+aggregated per view and served as JSON by metrics_view to staff users.
+Views declare the number of queries they're allowed with a query_budget attribute (or the query_budget()
+decorator for function views), see assertWithinQueryBudget() in educa/testing.py.
+The body of a streaming response is produced after its headers are sent: it's added to the view's
+aggregated metrics once it's consumed, while the headers only cover the view itself.
+"""
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.db import connections
+from django.http import JsonResponse
+from django.template.backends.django import Template
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.queries = 0
+        self.orm_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0  # templates rendered by other templates are timed once
+        self.cache_depth = 0  # lookups made by get_many() itself are counted once
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_time = 0.0
+
+    @contextmanager
+    def collect(self):
+        """Makes these the current metrics and counts the queries run in the block, which is timed."""
+        token = current_metrics.set(self)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self.execute_wrapper))
+                yield
+        finally:
+            self.total_time += time.perf_counter() - start
+            current_metrics.reset(token)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        # installed on every database connection for the duration of the request
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.orm_time += time.perf_counter() - start
+
+    def as_dict(self):
+        return {'queries': self.queries, 'orm_ms': round(self.orm_time * 1000, 2),
+                'template_ms': round(self.template_time * 1000, 2), 'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses, 'total_ms': round(self.total_time * 1000, 2)}
+
+
+def query_budget(queries):
+    """Declares the query budget of a function view, class-based views set a query_budget attribute."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def get_query_budget(view):
+    # as_view() keeps the class as view_class, DRF viewsets as cls
+    for candidate in (view, getattr(view, 'view_class', None), getattr(view, 'cls', None)):
+        budget = getattr(candidate, 'query_budget', None)
+        if budget is not None:
+            return budget
+    return None
+
+
+_missing = object()
+
+
+def instrument_cache(cache):
+    """Counts the hits and misses of get() and get_many() of a cache instance. get_many() calls get()
+    for each key on most backends, those nested lookups aren't counted a second time."""
+    if getattr(cache, '_instrumented', False):
+        return
+    get, get_many = cache.get, cache.get_many
+
+    @wraps(get)
+    def instrumented_get(key, default=None, version=None):
+        value = get(key, _missing, version=version)
+        metrics = current_metrics.get()
+        if metrics is not None and not metrics.cache_depth:
+            if value is _missing:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _missing else value
+
+    @wraps(get_many)
+    def instrumented_get_many(keys, version=None):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return get_many(keys, version=version)
+        keys = list(keys)
+        metrics.cache_depth += 1
+        try:
+            values = get_many(keys, version=version)
+        finally:
+            metrics.cache_depth -= 1
+        if not metrics.cache_depth:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    # on the instance only, the backend classes are left untouched
+    cache.get, cache.get_many = instrumented_get, instrumented_get_many
+    cache._instrumented = True
+
+
+def instrument_templates():
+    """Times Template.render() of the Django template backend, used by render(), render_to_string()
+    and TemplateResponse alike."""
+    if getattr(Template, '_instrumented', False):
+        return
+    render = Template.render
+
+    @wraps(render)
+    def instrumented_render(self, *args, **kwargs):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+    Template.render = instrumented_render
+    Template._instrumented = True
+
+
+class ViewStats(object):
+    """Metrics of every request served by this process, added up per view."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, view_name, metrics):
+        with self.lock:
+            stats = self.views.setdefault(view_name, {'requests': 0, 'queries': 0, 'max_queries': 0,
+                                                      'orm_ms': 0.0, 'template_ms': 0.0, 'total_ms': 0.0,
+                                                      'cache_hits': 0, 'cache_misses': 0})
+            values = metrics.as_dict()
+            stats['requests'] += 1
+            stats['max_queries'] = max(stats['max_queries'], metrics.queries)
+            for name in ('queries', 'orm_ms', 'template_ms', 'total_ms', 'cache_hits', 'cache_misses'):
+                stats[name] += values[name]
+
+    def snapshot(self):
+        with self.lock:
+            return {view_name: dict(stats) for view_name, stats in self.views.items()}
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+view_stats = ViewStats()
+
+
+class RequestMetricsMiddleware(object):
+    """Collects the metrics of each request, placed first in MIDDLEWARE so that it sees every query."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        # caches[alias] holds an instance per thread, instrumented the first time it's seen
+        for alias in settings.CACHES:
+            instrument_cache(caches[alias])
+        metrics = RequestMetrics()
+        with metrics.collect():
+            response = self.get_response(request)
+        response.metrics = metrics
+        match = request.resolver_match
+        if match is not None and match.func is not metrics_view:
+            if getattr(settings, 'METRICS_HEADERS', settings.DEBUG):
+                self.add_headers(response, metrics)
+            if response.streaming:
+                response.streaming_content = self.stream(response.streaming_content, metrics, match.view_name)
+            else:
+                view_stats.add(match.view_name, metrics)
+        return response
+
+    def stream(self, content, metrics, view_name):
+        # the server consumes it once the middleware has returned, each chunk is collected again
+        try:
+            while True:
+                with metrics.collect():
+                    chunk = next(content, _missing)
+                if chunk is _missing:
+                    return
+                yield chunk
+        finally:
+            # also when the client went away before the end
+            view_stats.add(view_name, metrics)
+
+    def add_headers(self, response, metrics):
+        values = metrics.as_dict()
+        response['X-Query-Count'] = metrics.queries
+        response['X-Cache-Hits'] = metrics.cache_hits
+        response['X-Cache-Misses'] = metrics.cache_misses
+        response['Server-Timing'] = (f'db;desc="{metrics.queries} queries";dur={values["orm_ms"]}, '
+                                     f'tpl;dur={values["template_ms"]}, total;dur={values["total_ms"]}')
+
+
+@staff_member_required
+def metrics_view(request):
+    return JsonResponse({'views': view_stats.snapshot()})
@@ -1,9 +1,15 @@
+from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import chat.routing
+
+# the Django ASGI application must be created before importing consumers and models
+django_asgi_app = get_asgi_application()
+
+import chat.routing  # noqa: E402
+from chat.middleware import CachedAuthMiddlewareStack  # noqa: E402
 
 application = ProtocolTypeRouter({
-    'websocket': AuthMiddlewareStack(
+    'http': django_asgi_app,
+    'websocket': CachedAuthMiddlewareStack(
         URLRouter(
             chat.routing.websocket_urlpatterns
         )
@@ -12,6 +18,6 @@ application = ProtocolTypeRouter({
 # ProtocolTypeRouter- maps HTTP requests to the standard Django views if no  http mapping is provided
 # URLRouter- maps websocket connections URL patterns in the 'websocket_urlpatterns'
 
-# AuthMiddlewareStack- supports standard Django authentication, where the user details are stored in the session.
+# CachedAuthMiddlewareStack- supports standard Django authentication, where the user details are stored in the session,
+# like AuthMiddlewareStack, but reads the session and the user from the cache (see chat/middleware.py).
 # Access the user instance in the scope of the consumer to identify the user who sends a message.
-
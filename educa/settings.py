@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'embed_video',
     'memcache_status',  # displays statistics for your Memcached instances in the admin site
     'rest_framework',
+    'rest_framework.authtoken',
     'chat',
     'channels',
 ]
@@ -53,6 +54,8 @@ INSTALLED_APPS = [
 # middleware are executed in the given order during the request phase,
 # and in reverse order during the response phase
 MIDDLEWARE = [
+    # first, so that the queries of every other middleware are counted
+    'educa.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',
@@ -65,6 +68,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# query count, cache hits and timings of each request in response headers (see educa/metrics.py)
+METRICS_HEADERS = DEBUG
+
 CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 60 * 15  # set timeout to 15 minutes
 CACHE_MIDDLEWARE_KEY_PREFIX = 'educa'
@@ -101,6 +107,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # a file rather than SQLite's default in-memory test database, which threads can't share
+        # (OrderFieldConcurrencyTests inserts from several connections at once)
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -164,14 +173,30 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 # Remember that MEDIA_URL is the base URL to serve uploaded media files and
 # MEDIA_ROOT is the local path where the files are located.
+# Chunked uploads in progress (see courses/api/uploads.py), outside of MEDIA_ROOT so they're never served
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'uploads/')
+# processes resizing Image contents in the background (see courses/images.py), 0 resizes them inline
+IMAGE_VARIANT_WORKERS = 2
 
+# Memcached through a pooled client, with an in-process LRU in front of it for the tagged entries
+# of courses.cache_tags, whose keys change whenever what they depend on changes (see educa/cache.py).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'BACKEND': 'educa.cache.TwoTierCache',
         'LOCATION': '127.0.0.1:11211',
+        'OPTIONS': {
+            'L1_KEY_PREFIXES': ['tagged:'],
+            'L1_MAX_ENTRIES': 2000,
+            'L1_TIMEOUT': 60,
+            'max_pool_size': 16,
+        },
     }
 }
 
+# Sessions are read from the cache and only fall back to the database on a miss,
+# the websocket handshake of the chat reads them on every connection.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -182,3 +207,12 @@ REST_FRAMEWORK = {
 # ASGI_APPLICATION = 'educa.routing.application'
 ASGI_APPLICATION = 'educa.asgi.application'
 
+
+# Channel layer used by the chat consumers to broadcast messages to a course's room.
+# The in-memory layer needs no external service, but only reaches the consumers of the same process:
+# run a single ASGI worker process per deployment (or switch to a channels_redis layer to scale out).
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
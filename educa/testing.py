@@ -0,0 +1,102 @@
+"""Test helpers shared by the apps of the project."""
+import socketserver
+import threading
+from .metrics import get_query_budget
+
+
+class QueryBudgetMixin(object):
+    """Checks the number of queries of a response, recorded by RequestMetricsMiddleware,
+    against the query_budget declared by the view that served it."""
+
+    def assertWithinQueryBudget(self, response):
+        self.assertEqual(response.status_code, 200)  # an error or a redirect says nothing about the view
+        view = response.resolver_match.func
+        budget = get_query_budget(view)
+        name = response.resolver_match.view_name
+        self.assertIsNotNone(budget, f'{name} declares no query_budget')
+        self.assertLessEqual(response.metrics.queries, budget,
+                             f'{name} ran {response.metrics.queries} queries, its budget is {budget}')
+
+
+class MemcachedStub(object):
+    """
+    In-process server speaking the subset of the memcached text protocol that pymemcache uses,
+    so that cache backends can be tested without a memcached server. Expiry times are ignored.
+        with MemcachedStub() as stub:
+            caches = {'default': {'BACKEND': ..., 'LOCATION': stub.location}}
+    """
+
+    def __init__(self):
+        self.data = {}  # key -> (flags, value)
+        self.commands = []  # name of every command received, to count the round trips
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    reply = stub.execute(line.split(), self.rfile)
+                    if reply is not None:
+                        self.wfile.write(reply)
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.location = '%s:%s' % self.server.server_address
+
+    def execute(self, args, rfile):
+        command, args = args[0].decode(), args[1:]
+        noreply = args[-1:] == [b'noreply']
+        with self.lock:
+            self.commands.append(command)
+            if command in ('get', 'gets'):
+                reply = b''.join(b'VALUE %s %s %d\r\n%s\r\n' % (key, self.data[key][0], len(self.data[key][1]),
+                                                               self.data[key][1])
+                                 for key in args if key in self.data)
+                reply += b'END\r\n'
+            elif command in ('set', 'add', 'replace'):
+                key, flags, size = args[0], args[1], int(args[3])
+                value = rfile.read(size + 2)[:-2]
+                if (command == 'add' and key in self.data) or (command == 'replace' and key not in self.data):
+                    reply = b'NOT_STORED\r\n'
+                else:
+                    self.data[key] = (flags, value)
+                    reply = b'STORED\r\n'
+            elif command == 'delete':
+                reply = b'DELETED\r\n' if self.data.pop(args[0], None) else b'NOT_FOUND\r\n'
+            elif command in ('incr', 'decr'):
+                if args[0] in self.data:
+                    flags, value = self.data[args[0]]
+                    value = max(0, int(value) + (int(args[1]) if command == 'incr' else -int(args[1])))
+                    self.data[args[0]] = (flags, str(value).encode())
+                    reply = b'%d\r\n' % value
+                else:
+                    reply = b'NOT_FOUND\r\n'
+            elif command == 'touch':
+                reply = b'TOUCHED\r\n' if args[0] in self.data else b'NOT_FOUND\r\n'
+            elif command == 'flush_all':
+                self.data.clear()
+                reply = b'OK\r\n'
+            elif command == 'stats':
+                reply = b'STAT curr_items %d\r\nSTAT uptime 1\r\nEND\r\n' % len(self.data)
+            elif command == 'version':
+                reply = b'VERSION stub\r\n'
+            else:
+                reply = b'ERROR\r\n'
+        return None if noreply else reply
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
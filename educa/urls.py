@@ -19,6 +19,7 @@ from django.contrib.auth import views as auth_views
 from django.conf import settings
 from django.conf.urls.static import static
 from courses.views import CourseListView
+from educa.metrics import metrics_view
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -32,6 +33,7 @@ urlpatterns = [
     path('students/', include('students.urls')),
     path('api/', include('courses.api.urls'), name='api'),
     path('chat/', include('chat.urls', namespace='chat')),
+    path('metrics/', metrics_view, name='metrics'),
     # OR path('chat/', include('chat.urls'), name='chat'),
 ]
 # + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
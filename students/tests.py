@@ -1,3 +1,32 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from courses.models import Subject, Course, Module, Content, Text, Video
+from courses.tests import LOCMEM_CACHES
+from courses import cache_tags
+from educa.testing import QueryBudgetMixin
 
-# Create your tests here.
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache_tags.cache.clear()
+        self.student = User.objects.create_user('student', password='secret')
+        subject = Subject.objects.create(title='Programming', slug='programming')
+        self.course = Course.objects.create(owner=self.student, subject=subject,
+                                            title='Django', slug='django', overview='Web')
+        self.module = Module.objects.create(course=self.course, title='Intro')
+        for item in (Text.objects.create(owner=self.student, title='text', content='Hello'),
+                     Video.objects.create(owner=self.student, title='video',
+                                          url='https://www.youtube.com/watch?v=abc')):
+            Content.objects.create(module=self.module, item=item)
+        self.course.students.add(self.student)
+        self.client.login(username='student', password='secret')
+
+    def test_course_list(self):
+        self.assertWithinQueryBudget(self.client.get(reverse('student_course_list')))
+
+    def test_course_detail(self):
+        self.assertWithinQueryBudget(self.client.get(reverse('student_course_detail', args=[self.course.id])))
+        self.assertWithinQueryBudget(self.client.get(reverse('student_course_detail_module',
+                                                             args=[self.course.id, self.module.id])))
@@ -8,6 +8,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from .forms import CourseEnrollForm
 from django.views.generic.list import ListView
 from courses.models import Course
+from courses.enrollment import get_user_courses
 from django.views.generic.detail import DetailView
 
 
@@ -47,25 +48,30 @@ class StudentCourseListView(LoginRequiredMixin, ListView):
     """View for the logged-in user(student) to see the courses they've enrolled for."""
     model = Course
     template_name = 'students/course/list.html'
+    query_budget = 4  # session, user, enrollments on a cache miss and courses
 
     def get_queryset(self):
         qs = super().get_queryset()
-        return qs.filter(students__in=[self.request.user])  # to get all courses and filter the courses enrolled by the user
+        # the ids of the courses enrolled by the user come from the cached enrollment index
+        return qs.filter(id__in=get_user_courses(self.request.user))
 
 
 class StudentCourseDetailView(DetailView):
     model = Course
     template_name = 'students/course/detail.html'
+    # session, user, enrollments, course, module, and on a cache miss of the module's fragment
+    # its contents and one query per type of item
+    query_budget = 10
 
     def get_queryset(self):
         qs = super().get_queryset()
         # limit query to courses enrolled by the user
-        return qs.filter(students__in=[self.request.user])
+        return qs.filter(id__in=get_user_courses(self.request.user))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # get course object
-        course = self.get_object()
+        # get course object, already retrieved by get()
+        course = self.object
 
         if 'module_id' in self.kwargs:
             # get current module to include a module in the context if module_id is given
@@ -74,6 +80,7 @@ class StudentCourseDetailView(DetailView):
             # Otherwise get first module of the course
             context['module'] = course.modules.all()[0]
             # context['module'] = course.modules.first()
+        context['contents'] = context['module'].contents.with_items()
         return context
 
 # Clear db, delete sqlite and migrate again